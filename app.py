@@ -1,218 +1,342 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
+import threading
+import queue
+from contextlib import contextmanager
 from datetime import datetime
 import io
-from fpdf import FPDF
-import qrcode
 import json
 
 # ==============================================================================
 # Módulo: CONFIGURACIÓN Y PREPARACIÓN DE LA BASE DE DATOS
 # Descripción: Este módulo es el punto de partida de la aplicación. Se encarga de:
 # 1. Definir constantes globales: Como el nombre de la base de datos (DB_NAME) y las listas de opciones para los menús desplegables (APPLICATION_OPTIONS, UNIQUE_TOOL_APPLICATION_OPTIONS).
-# 2. Inicializar la base de datos (init_db): Crea todas las tablas necesarias si no existen al iniciar la aplicación. Esto asegura que la estructura de la base de datos esté siempre lista para ser utilizada.
+# 2. Inicializar la base de datos (init_db): Crea todas las tablas necesarias si no existen al iniciar la aplicación; se ejecuta una vez por proceso (`st.cache_resource`) y omite las comprobaciones si `PRAGMA user_version` ya coincide con `SCHEMA_VERSION`. Esto asegura que la estructura de la base de datos esté siempre lista para ser utilizada.
 #    - Tablas creadas: `responsibles`, `tools`, `inventory_movements`, `tool_types`, `part_number_equivalences`, `clients`.
 # 3. Migración de datos: Incluye una función para añadir la columna `well` a la tabla `inventory_movements` si no existe, garantizando la compatibilidad con versiones anteriores de la base de datos.
 # 4. Población inicial de datos: Si la tabla `responsibles` está vacía, la puebla con una lista inicial de nombres.
-# 5. Funciones de utilidad: Contiene `get_tool_details_by_id` para obtener detalles de una herramienta y `generate_qr_code` para crear códigos QR a partir de datos.
+# 5. Funciones de utilidad: Contiene `get_conn` para reutilizar una única conexión compartida (protegida por un lock) con los PRAGMAs de rendimiento (modo WAL, caché de páginas), `read_conn` para que las lecturas tomen una conexión de solo lectura de un pool y no esperen a las escrituras, `fetch_df` para consultas pequeñas sin el coste fijo de `read_sql_query`, `fetch_column` para las listas de una sola columna, `get_tool_details_by_ids` para obtener en una sola consulta los detalles de varias herramientas, `qr_png_bytes` para crear (con caché) el PNG del código QR de un contenido, `parse_batch_excel` para leer (con caché) el Excel del modo batch y `excel_bytes` para generar (con caché) el Excel de los reportes.
 # ==============================================================================
 
 DB_NAME = 'warehouse.db'
+SCHEMA_VERSION = 5 # Stored in PRAGMA user_version; bump it whenever init_db gains a schema change
+
+INSTALLED_PAGE_SIZE = 50 # Installed tools listed per page on Field Status
 
 APPLICATION_OPTIONS = ["Open Hole", "Cemented", "Intervention Tool", "Activation Ball", "Floating Equipment", "Miscellaneous"]
 UNIQUE_TOOL_APPLICATION_OPTIONS = ["Open Hole", "Cemented", "Intervention Tool", "Activation Ball", "Floating Equipment"]
+UNIQUE_TOOL_APPLICATION_OPTIONS_WITH_BLANK = [""] + UNIQUE_TOOL_APPLICATION_OPTIONS # Selectbox options with the empty "not chosen" entry first
+SEAT_SIZE_TYPES = frozenset({'Open Hole Multi-Entry Sleeve', 'Open Single-Entry Sleeve', 'Cemented Multi-Entry Sleeve', 'Cemented Single-Entry Sleeve', 'Open Hole Single-Entry Sleeve'}) # Sleeve types that take a Seat Size
+
+def _configure(conn):
+    """Applies the per-connection performance PRAGMAs."""
+    conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL, avoids an fsync on every commit
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536") # ~64 MB page cache
+    conn.execute("PRAGMA mmap_size=268435456") # Read pages straight from a 256 MB memory map
+    conn.execute("PRAGMA foreign_keys=ON") # Enforce inventory_movements.tool_id -> tools.id
+
+@st.cache_resource
+def _shared_connection():
+    """Opens the process-wide connection and the lock that serializes access to it."""
+    conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256) # Room for every statement the app issues
+    _configure(conn)
+    return conn, threading.RLock()
+
+@contextmanager
+def get_conn():
+    """Yields the shared connection while holding its lock, so sessions never interleave transactions."""
+    conn, lock = _shared_connection()
+    with lock:
+        try:
+            yield conn
+        except Exception:
+            conn.rollback() # Never leave a half-done transaction on the shared connection
+            raise
+
+@st.cache_resource
+def _read_pool():
+    """Holds idle read connections shared by all sessions; WAL lets them read while the shared connection writes."""
+    return queue.LifoQueue() # Most recently used first, so its page cache is still warm
+
+@contextmanager
+def read_conn():
+    """Yields a pooled read-only connection, opening a new one when every pooled connection is busy."""
+    pool = _read_pool()
+    try:
+        conn = pool.get_nowait()
+    except queue.Empty:
+        conn = sqlite3.connect(DB_NAME, check_same_thread=False, cached_statements=256)
+        _configure(conn)
+        conn.execute("PRAGMA query_only=ON") # Writes must go through get_conn
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+def fetch_df(query, params=()):
+    """Runs a small query and builds the DataFrame straight from fetchall, skipping read_sql_query's overhead."""
+    with read_conn() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        rows = c.fetchall()
+        columns = [d[0] for d in c.description]
+    return pd.DataFrame(rows, columns=columns)
+
+def fetch_column(query, params=()):
+    """Runs a single-column query and returns its values as a list."""
+    with read_conn() as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [r[0] for r in rows]
 
-def get_tool_details_by_id(tool_id):
-    """Retrieves full details of a tool by its ID."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT part_number, serial_number, description, tool_type, application, specific_type, attributes FROM tools WHERE id = ?", (tool_id,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        return {
-            'part_number': result[0],
-            'serial_number': result[1],
-            'description': result[2],
-            'tool_type': result[3],
-            'application': result[4],
-            'specific_type': result[5],
-            'attributes': result[6]
-        }
-    return None
-
-def generate_qr_code(data_dict):
-    """Generates a QR code image from a dictionary of data."""
-    qr_data = json.dumps(data_dict)
+TOOL_DETAILS_SQL = """
+    SELECT t.id, t.part_number, t.serial_number, t.description, t.tool_type, t.application, t.specific_type, t.attributes,
+           pe.client_pn, pe.client_description
+    FROM tools t
+    LEFT JOIN part_number_equivalences pe ON pe.supplier_pn = t.part_number
+    WHERE t.id IN (SELECT value FROM json_each(?))
+""" # One fixed text, so the statement cache parses it once
+
+def get_tool_details_by_ids(tool_ids):
+    """Retrieves full details of several tools, with their client Part Number equivalence, in one query as {id: details}."""
+    with read_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row # Only this cursor; other readers index rows by position
+        rows = c.execute(TOOL_DETAILS_SQL, (json.dumps([int(tool_id) for tool_id in tool_ids]),)).fetchall()
+    return {row['id']: dict(row) for row in rows}
+
+@st.cache_data(max_entries=512)
+def qr_png_bytes(qr_data):
+    """Renders the PNG bytes of a QR code for a JSON string; cached so identical payloads are encoded once."""
+    import qrcode # Imported lazily: only needed when a note is generated
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+        box_size=4, # Small raster is enough for the 30 mm QR on the PDFs and is much cheaper to encode
+        border=2,
     )
     qr.add_data(qr_data)
     qr.make(fit=True)
 
     img = qr.make_image(fill_color="black", back_color="white")
     img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG')
-    img_byte_arr.seek(0) # Important: Rewind the buffer to the beginning
-    return img_byte_arr
+    img.save(img_byte_arr, format='PNG', compress_level=1) # Fast zlib level; the image is tiny anyway
+    return img_byte_arr.getvalue()
+
+@st.cache_data
+def parse_batch_excel(data):
+    """Parses an uploaded batch Excel file; cached on the file bytes so reruns skip the openpyxl parse."""
+    return pd.read_excel(io.BytesIO(data), dtype=str, engine='openpyxl').fillna('')
+
+@st.cache_data(ttl=600)
+def excel_bytes(df, sheet_name):
+    """Serializes a report DataFrame to xlsx; cached on the frame's contents so repeat downloads skip xlsxwriter."""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name=sheet_name)
+    return output.getvalue()
+
+@st.cache_resource
+def init_db():
+    """Initializes the database and creates tables if they don't exist (once per process)."""
+    with get_conn() as conn:
+        c = conn.cursor()
+
+        # WAL lets readers and the writer work concurrently; the mode is persistent on the DB file
+        c.execute("PRAGMA journal_mode=WAL")
+
+        # Skip the schema checks entirely when the file is already up to date
+        c.execute("PRAGMA user_version")
+        if c.fetchone()[0] >= SCHEMA_VERSION:
+            return
+
+        c.execute("BEGIN IMMEDIATE") # Run the whole bootstrap as one transaction (DDL included)
+
+        # Table for responsibles
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS responsibles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        # Table for tool definitions
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS tools (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                part_number TEXT NOT NULL,
+                serial_number TEXT,
+                description TEXT,
+                tool_type TEXT NOT NULL, -- 'Unique_Tools' or 'Miscelaneous'
+                application TEXT NOT NULL, -- 'Open Hole' or 'Cemented'
+                specific_type TEXT NOT NULL,
+                attributes TEXT, -- JSON for extra attributes
+                is_active BOOLEAN DEFAULT 1,
+                UNIQUE(part_number, serial_number)
+            )
+        ''')
+
+        # Table for inventory movements (the core log)
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS inventory_movements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tool_id INTEGER NOT NULL,
+                movement_type TEXT NOT NULL, -- 'Importation', 'Return', 'Dispatch', 'Installed'
+                quantity INTEGER,
+                location TEXT NOT NULL, -- 'Warehouse', 'Field', 'Installed'
+                date TEXT NOT NULL,
+                responsible TEXT NOT NULL,
+                sales_order TEXT,
+                FOREIGN KEY(tool_id) REFERENCES tools(id)
+            )
+        ''')
+
+        # Materialized stock per tool and well, kept in sync by the movement writers
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tool_stock'")
+        stock_table_exists = c.fetchone() is not None
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS tool_stock (
+                tool_id INTEGER NOT NULL,
+                well TEXT NOT NULL DEFAULT '', -- '' stands for movements without a well
+                warehouse_stock INTEGER NOT NULL DEFAULT 0,
+                field_stock INTEGER NOT NULL DEFAULT 0,
+                installed_stock INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY(tool_id, well)
+            )
+        ''')
+
+        # Table for manageable tool types
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS tool_types (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                application TEXT NOT NULL,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        # Table for part number equivalences
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS part_number_equivalences (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                supplier_pn TEXT UNIQUE NOT NULL,
+                client_pn TEXT UNIQUE NOT NULL,
+                client_description TEXT
+            )
+        ''')
+
+        # Table for clients
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS clients (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        # Table for wells
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS wells (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE NOT NULL,
+                latitude TEXT,
+                longitude TEXT,
+                well_trajectory TEXT,
+                well_fluid TEXT,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
 
+        # --- Data Migration / Initial Population ---
 
-def init_db():
-    """Initializes the database and creates tables if they don't exist."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-
-    # Table for responsibles
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS responsibles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-
-    # Table for tool definitions
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tools (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            part_number TEXT NOT NULL,
-            serial_number TEXT,
-            description TEXT,
-            tool_type TEXT NOT NULL, -- 'Unique_Tools' or 'Miscelaneous'
-            application TEXT NOT NULL, -- 'Open Hole' or 'Cemented'
-            specific_type TEXT NOT NULL,
-            attributes TEXT, -- JSON for extra attributes
-            is_active BOOLEAN DEFAULT 1,
-            UNIQUE(part_number, serial_number)
-        )
-    ''')
-
-    # Table for inventory movements (the core log)
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS inventory_movements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            tool_id INTEGER NOT NULL,
-            movement_type TEXT NOT NULL, -- 'Importation', 'Return', 'Dispatch', 'Installed'
-            quantity INTEGER,
-            location TEXT NOT NULL, -- 'Warehouse', 'Field', 'Installed'
-            date TEXT NOT NULL,
-            responsible TEXT NOT NULL,
-            sales_order TEXT,
-            FOREIGN KEY(tool_id) REFERENCES tools(id)
-        )
-    ''')
-
-    # Table for manageable tool types
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS tool_types (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            application TEXT NOT NULL,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-
-    # Table for part number equivalences
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS part_number_equivalences (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            supplier_pn TEXT UNIQUE NOT NULL,
-            client_pn TEXT UNIQUE NOT NULL,
-            client_description TEXT
-        )
-    ''')
-
-    # Table for clients
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS clients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-
-    # Table for wells
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS wells (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE NOT NULL,
-            latitude TEXT,
-            longitude TEXT,
-            well_trajectory TEXT,
-            well_fluid TEXT,
-            is_active BOOLEAN DEFAULT 1
-        )
-    ''')
-
-    # --- Data Migration / Initial Population ---
-
-    # Add 'well' column to inventory_movements if it doesn't exist (for backwards compatibility)
-    c.execute("PRAGMA table_info(inventory_movements)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'well' not in columns:
-        c.execute("ALTER TABLE inventory_movements ADD COLUMN well TEXT")
-
-    # Add 'description' column to tools if it doesn't exist
-    c.execute("PRAGMA table_info(tools)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'description' not in columns:
-        c.execute("ALTER TABLE tools ADD COLUMN description TEXT")
-
-    # Add 'attributes' column to tools if it doesn't exist
-    c.execute("PRAGMA table_info(tools)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'attributes' not in columns:
-        c.execute("ALTER TABLE tools ADD COLUMN attributes TEXT")
-
-    # Add 'client_description' column to part_number_equivalences if it doesn't exist
-    c.execute("PRAGMA table_info(part_number_equivalences)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'client_description' not in columns:
-        c.execute("ALTER TABLE part_number_equivalences ADD COLUMN client_description TEXT")
-
-    # Add 'latitude' column to wells if it doesn't exist
-    c.execute("PRAGMA table_info(wells)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'latitude' not in columns:
-        c.execute("ALTER TABLE wells ADD COLUMN latitude TEXT")
-
-    # Add 'longitude' column to wells if it doesn't exist
-    c.execute("PRAGMA table_info(wells)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'longitude' not in columns:
-        c.execute("ALTER TABLE wells ADD COLUMN longitude TEXT")
-
-    # Add 'is_active' column to wells if it doesn't exist
-    c.execute("PRAGMA table_info(wells)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'is_active' not in columns:
-        c.execute("ALTER TABLE wells ADD COLUMN is_active BOOLEAN DEFAULT 1")
-
-    # Add 'well_trajectory' column to wells if it doesn't exist
-    c.execute("PRAGMA table_info(wells)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'well_trajectory' not in columns:
-        c.execute("ALTER TABLE wells ADD COLUMN well_trajectory TEXT")
-
-    # Add 'well_fluid' column to wells if it doesn't exist
-    c.execute("PRAGMA table_info(wells)")
-    columns = [info[1] for info in c.fetchall()]
-    if 'well_fluid' not in columns:
-        c.execute("ALTER TABLE wells ADD COLUMN well_fluid TEXT")
-
-    # Populate initial responsibles if table is empty
-    c.execute("SELECT COUNT(*) FROM responsibles")
-    if c.fetchone()[0] == 0:
-        initial_names = ['Pablo', 'Antony', 'Warith']
-        for name in initial_names:
-            c.execute("INSERT INTO responsibles (name) VALUES (?)" , (name,))
-
-    conn.commit()
-    conn.close()
+        # Columns added after the first release; older database files get them via ALTER TABLE
+        added_columns = {
+            'inventory_movements': [('well', 'TEXT')],
+            'tools': [('description', 'TEXT'), ('attributes', 'TEXT')],
+            'part_number_equivalences': [('client_description', 'TEXT')],
+            'wells': [('latitude', 'TEXT'), ('longitude', 'TEXT'), ('is_active', 'BOOLEAN DEFAULT 1'), ('well_trajectory', 'TEXT'), ('well_fluid', 'TEXT')],
+        }
+        for table, table_columns in added_columns.items():
+            c.execute(f"PRAGMA table_info({table})") # One scan per table
+            columns = {info[1] for info in c.fetchall()}
+            for column, column_type in table_columns:
+                if column not in columns:
+                    c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+        # Full-text index over the searchable tool fields; trigram tokens keep LIKE '%term%' semantics
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tools_fts'")
+        tools_fts_exists = c.fetchone() is not None
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS tools_fts USING fts5(
+                part_number, serial_number, description,
+                content='tools', content_rowid='id', tokenize='trigram'
+            )
+        ''')
+        # Triggers are created one by one: executescript would commit the bootstrap transaction
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS tools_fts_ai AFTER INSERT ON tools BEGIN
+                INSERT INTO tools_fts(rowid, part_number, serial_number, description)
+                VALUES (new.id, new.part_number, new.serial_number, new.description);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS tools_fts_ad AFTER DELETE ON tools BEGIN
+                INSERT INTO tools_fts(tools_fts, rowid, part_number, serial_number, description)
+                VALUES ('delete', old.id, old.part_number, old.serial_number, old.description);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS tools_fts_au AFTER UPDATE ON tools BEGIN
+                INSERT INTO tools_fts(tools_fts, rowid, part_number, serial_number, description)
+                VALUES ('delete', old.id, old.part_number, old.serial_number, old.description);
+                INSERT INTO tools_fts(rowid, part_number, serial_number, description)
+                VALUES (new.id, new.part_number, new.serial_number, new.description);
+            END
+        ''')
+        if not tools_fts_exists:
+            c.execute("INSERT INTO tools_fts(tools_fts) VALUES ('rebuild')") # Index the existing tools
+
+        # Populate initial responsibles if table is empty
+        c.execute("SELECT COUNT(*) FROM responsibles")
+        if c.fetchone()[0] == 0:
+            initial_names = ['Pablo', 'Antony', 'Warith']
+            c.executemany("INSERT OR IGNORE INTO responsibles (name) VALUES (?)", [(name,) for name in initial_names])
+
+        # Indexes for the stock aggregations, history date range and well filters
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing_indexes = {r[0] for r in c.fetchall()}
+        indexes = {
+            # Covers GROUP BY tool_id, well with SUM(CASE movement_type ... quantity) without touching the table
+            'idx_mov_stock': "CREATE INDEX IF NOT EXISTS idx_mov_stock ON inventory_movements(tool_id, well, movement_type, quantity)",
+            'idx_mov_date': "CREATE INDEX IF NOT EXISTS idx_mov_date ON inventory_movements(date)",
+            'idx_mov_well': "CREATE INDEX IF NOT EXISTS idx_mov_well ON inventory_movements(well)",
+            # Latest movement of a given type per tool (installation date/well, latest import) without a sort
+            'idx_mov_tool_type': "CREATE INDEX IF NOT EXISTS idx_mov_tool_type ON inventory_movements(tool_id, movement_type)",
+            'idx_mov_sales_order': "CREATE INDEX IF NOT EXISTS idx_mov_sales_order ON inventory_movements(sales_order)",
+            # Wells with field stock, grouped straight off the index (tool_stock's key leads with tool_id)
+            'idx_tool_stock_well': "CREATE INDEX IF NOT EXISTS idx_tool_stock_well ON tool_stock(well, field_stock)",
+            # Index-only, already ordered answer for get_tool_types_by_application
+            'idx_tool_types_app': "CREATE INDEX IF NOT EXISTS idx_tool_types_app ON tool_types(application, is_active, name)",
+            # Name-ordered, index-only scans for the active/all selectbox lists (the UNIQUE name index alone needs a row lookup for is_active)
+            'idx_responsibles_name_active': "CREATE INDEX IF NOT EXISTS idx_responsibles_name_active ON responsibles(name, is_active)",
+            'idx_clients_name_active': "CREATE INDEX IF NOT EXISTS idx_clients_name_active ON clients(name, is_active)",
+            'idx_wells_name_active': "CREATE INDEX IF NOT EXISTS idx_wells_name_active ON wells(name, is_active)",
+        }
+        for sql in indexes.values():
+            c.execute(sql)
+        if not existing_indexes.issuperset(indexes):
+            c.execute("ANALYZE") # Refresh planner statistics only when a new index was added
+
+        conn.commit()
+
+        if not stock_table_exists:
+            rebuild_stock() # Backfill the new table from the existing movement history
+
+        # Only mark the file as current once every step above has succeeded
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
 
 # ==============================================================================
 # Módulo: FUNCIONES AUXILIARES DE LA BASE DE DATOS
@@ -222,226 +346,202 @@ def init_db():
 # - Gestión de Responsables: `get_responsibles`, `manage_responsible` (añadir, editar, desactivar).
 # - Gestión de Tipos de Herramienta: `get_tool_types_df`, `manage_tool_type`, `get_tool_types_by_application`.
 # - Gestión de Clientes: `get_clients`, `manage_client`.
-# - Gestión de Equivalencias de Números de Parte: `add_part_number_equivalence`, `get_part_number_equivalences`, `delete_part_number_equivalence`.
-# - Gestión de Herramientas: `get_all_tools_for_management`, `delete_tool`.
+# - Gestión de Equivalencias de Números de Parte: `add_part_number_equivalence` / `add_part_number_equivalences` (carga masiva desde CSV), `get_part_number_equivalences`, `delete_part_number_equivalence`.
+# - Gestión de Herramientas: `get_all_tools_for_management`, `delete_tools`.
 # - Operaciones de Reseteo: `reset_all_data` para borrar todos los datos de herramientas y movimientos, una función crítica y peligrosa para la administración.
+# - Caché: las listas de responsables, clientes, pozos y tipos de herramienta se guardan con `st.cache_data`; cada función `manage_*` invalida solo la suya.
 # ==============================================================================
 
+@st.cache_data(ttl=300)
 def get_responsibles(active_only=True):
     """Gets the list of responsibles."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    query = "SELECT name FROM responsibles WHERE is_active = 1 ORDER BY name" if active_only else "SELECT name FROM responsibles ORDER BY name"
-    c.execute(query)
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    # One fixed SQL text for both variants so the connection's statement cache reuses it
+    return fetch_column("SELECT name FROM responsibles WHERE is_active >= ? ORDER BY name", (1 if active_only else 0,))
 
 def manage_responsible(action, name, new_name=None):
     """Adds, edits, or deactivates a responsible."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    if action == 'add' and name:
-        c.execute("INSERT OR IGNORE INTO responsibles (name) VALUES (?)", (name,))
-    elif action == 'edit' and name and new_name:
-        c.execute("UPDATE responsibles SET name = ? WHERE name = ?", (new_name, name))
-    elif action == 'deactivate' and name:
-        c.execute("UPDATE responsibles SET is_active = 0 WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
-    st.cache_data.clear()
+    with get_conn() as conn:
+        c = conn.cursor()
+        if action == 'add' and name:
+            c.execute("INSERT OR IGNORE INTO responsibles (name) VALUES (?)", (name,))
+        elif action == 'edit' and name and new_name:
+            c.execute("UPDATE responsibles SET name = ? WHERE name = ?", (new_name, name))
+        elif action == 'deactivate' and name:
+            c.execute("UPDATE responsibles SET is_active = 0 WHERE name = ?", (name,))
+        conn.commit()
+    get_responsibles.clear()
 
 def get_tool_types_df():
     """Gets a DataFrame of all tool types for display in Admin."""
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT id, name, application, is_active FROM tool_types ORDER BY name", conn)
-    conn.close()
-    return df
+    return fetch_df("SELECT id, name, application, is_active FROM tool_types ORDER BY name")
 
 def manage_tool_type(action, name, application=None, new_name=None):
     """Adds, edits, or deactivates a tool type."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    if action == 'add_or_edit' and name and application:
-        # Use INSERT OR REPLACE to handle both adding and editing based on the unique name
-        c.execute("INSERT OR REPLACE INTO tool_types (id, name, application) VALUES ((SELECT id FROM tool_types WHERE name = ?), ?, ?)", (name, name, application))
-    elif action == 'deactivate' and name:
-        c.execute("UPDATE tool_types SET is_active = 0 WHERE name = ?", (name,))
-    elif action == 'edit_name' and name and new_name:
-        c.execute("UPDATE tool_types SET name = ? WHERE name = ?", (new_name, name))
-    conn.commit()
-    conn.close()
+    with get_conn() as conn:
+        c = conn.cursor()
+        if action == 'add_or_edit' and name and application:
+            # Upsert on the unique name: updates in place instead of delete + reinsert; re-adding reactivates the type
+            c.execute("""
+                INSERT INTO tool_types (name, application) VALUES (?, ?)
+                ON CONFLICT(name) DO UPDATE SET application = excluded.application, is_active = 1
+            """, (name, application))
+        elif action == 'deactivate' and name:
+            c.execute("UPDATE tool_types SET is_active = 0 WHERE name = ?", (name,))
+        elif action == 'edit_name' and name and new_name:
+            c.execute("UPDATE tool_types SET name = ? WHERE name = ?", (new_name, name))
+        conn.commit()
+    get_tool_types_by_application.clear()
 
+@st.cache_data(ttl=300)
 def get_tool_types_by_application(application):
     """Gets active tool types for a specific application."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT name FROM tool_types WHERE application = ? AND is_active = 1 ORDER BY name", (application,))
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return fetch_column("SELECT name FROM tool_types WHERE application = ? AND is_active = 1 ORDER BY name", (application,))
+
+def add_part_number_equivalences(rows):
+    """Adds or updates several (supplier_pn, client_pn, client_description) equivalences in one transaction."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.executemany("""
+                INSERT INTO part_number_equivalences (supplier_pn, client_pn, client_description) VALUES (?, ?, ?)
+                ON CONFLICT(supplier_pn) DO UPDATE SET client_pn = excluded.client_pn, client_description = excluded.client_description
+            """, rows)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    get_part_number_equivalences.clear()
 
 def add_part_number_equivalence(supplier_pn, client_pn, client_description):
     """Adds a new part number equivalence."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("INSERT OR REPLACE INTO part_number_equivalences (id, supplier_pn, client_pn, client_description) VALUES ((SELECT id FROM part_number_equivalences WHERE supplier_pn = ?), ?, ?, ?)", (supplier_pn, supplier_pn, client_pn, client_description))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    add_part_number_equivalences([(supplier_pn, client_pn, client_description)])
 
+@st.cache_data(ttl=300)
 def get_part_number_equivalences():
     """Gets all part number equivalences."""
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT supplier_pn, client_pn, client_description FROM part_number_equivalences ORDER BY supplier_pn", conn)
-    conn.close()
-    return df
+    return fetch_df("SELECT supplier_pn, client_pn, client_description FROM part_number_equivalences ORDER BY supplier_pn")
 
 def delete_part_number_equivalence(supplier_pn):
     """Deletes a part number equivalence by supplier_pn."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("DELETE FROM part_number_equivalences WHERE supplier_pn = ?", (supplier_pn,))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
-
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("DELETE FROM part_number_equivalences WHERE supplier_pn = ?", (supplier_pn,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    get_part_number_equivalences.clear()
+
+@st.cache_data(ttl=300)
 def get_clients(active_only=True):
     """Gets the list of clients."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    query = "SELECT name FROM clients WHERE is_active = 1 ORDER BY name" if active_only else "SELECT name FROM clients ORDER BY name"
-    c.execute(query)
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return fetch_column("SELECT name FROM clients WHERE is_active >= ? ORDER BY name", (1 if active_only else 0,))
 
 def manage_client(action, name, new_name=None):
     """Adds, edits, or deactivates a client."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    if action == 'add' and name:
-        c.execute("INSERT OR IGNORE INTO clients (name) VALUES (?)", (name,))
-    elif action == 'edit' and name and new_name:
-        c.execute("UPDATE clients SET name = ? WHERE name = ?", (new_name, name))
-    elif action == 'deactivate' and name:
-        c.execute("UPDATE clients SET is_active = 0 WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
-    st.cache_data.clear()
+    with get_conn() as conn:
+        c = conn.cursor()
+        if action == 'add' and name:
+            c.execute("INSERT OR IGNORE INTO clients (name) VALUES (?)", (name,))
+        elif action == 'edit' and name and new_name:
+            c.execute("UPDATE clients SET name = ? WHERE name = ?", (new_name, name))
+        elif action == 'deactivate' and name:
+            c.execute("UPDATE clients SET is_active = 0 WHERE name = ?", (name,))
+        conn.commit()
+    get_clients.clear()
 
+@st.cache_data(ttl=300)
 def get_wells(active_only=True):
     """Gets the list of wells."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    query = "SELECT name, latitude, longitude, well_trajectory, well_fluid FROM wells WHERE is_active = 1 ORDER BY name" if active_only else "SELECT name, latitude, longitude, well_trajectory, well_fluid FROM wells ORDER BY name"
-    c.execute(query)
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return fetch_column("SELECT name FROM wells WHERE is_active >= ? ORDER BY name", (1 if active_only else 0,))
 
+@st.cache_data(ttl=300)
 def get_all_wells_for_admin():
     """Gets a DataFrame of all wells for display in Admin."""
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT id, name, latitude, longitude, well_trajectory, well_fluid, is_active FROM wells ORDER BY name", conn)
-    conn.close()
-    return df
+    return fetch_df("SELECT id, name, latitude, longitude, well_trajectory, well_fluid, is_active FROM wells ORDER BY name")
 
+@st.cache_data(ttl=300)
 def get_all_wells_for_map():
     """Gets a DataFrame of all wells (active and inactive) with coordinates for map display."""
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT name, latitude, longitude, well_trajectory, well_fluid FROM wells WHERE latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY name", conn)
-    conn.close()
-    # Convert latitude and longitude to numeric, handling potential errors
-    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-    # Drop rows where conversion failed
-    df.dropna(subset=['latitude', 'longitude'], inplace=True)
-    print("DataFrame for map:")
-    print(df)
-    print("DataFrame dtypes:")
-    print(df.dtypes)
+    with read_conn() as conn:
+        # Cast in SQL and keep only coordinates that look numeric (digits, sign, point, exponent)
+        df = pd.read_sql_query("""
+            SELECT
+                name,
+                CAST(trim(latitude) AS REAL) AS latitude,
+                CAST(trim(longitude) AS REAL) AS longitude,
+                well_trajectory,
+                well_fluid
+            FROM wells
+            WHERE trim(latitude) GLOB '*[0-9]*' AND trim(latitude) NOT GLOB '*[^0-9.+eE-]*'
+              AND trim(longitude) GLOB '*[0-9]*' AND trim(longitude) NOT GLOB '*[^0-9.+eE-]*'
+            ORDER BY name
+        """, conn)
     return df
 
 def manage_well(action, name, new_name=None, latitude=None, longitude=None, well_trajectory=None, well_fluid=None):
     """Adds, edits, or deactivates a well."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    if action == 'add' and name:
-        c.execute("INSERT OR IGNORE INTO wells (name, latitude, longitude, well_trajectory, well_fluid) VALUES (?, ?, ?, ?, ?)", (name, latitude, longitude, well_trajectory, well_fluid))
-    elif action == 'edit' and name and new_name:
-        c.execute("UPDATE wells SET name = ?, latitude = ?, longitude = ?, well_trajectory = ?, well_fluid = ? WHERE name = ?", (new_name, latitude, longitude, well_trajectory, well_fluid, name))
-    elif action == 'deactivate' and name:
-        c.execute("UPDATE wells SET is_active = 0 WHERE name = ?", (name,))
-    conn.commit()
-    conn.close()
-    st.cache_data.clear()
+    with get_conn() as conn:
+        c = conn.cursor()
+        if action == 'add' and name:
+            c.execute("INSERT OR IGNORE INTO wells (name, latitude, longitude, well_trajectory, well_fluid) VALUES (?, ?, ?, ?, ?)", (name, latitude, longitude, well_trajectory, well_fluid))
+        elif action == 'edit' and name and new_name:
+            c.execute("UPDATE wells SET name = ?, latitude = ?, longitude = ?, well_trajectory = ?, well_fluid = ? WHERE name = ?", (new_name, latitude, longitude, well_trajectory, well_fluid, name))
+        elif action == 'deactivate' and name:
+            c.execute("UPDATE wells SET is_active = 0 WHERE name = ?", (name,))
+        conn.commit()
+    get_wells.clear()
+    get_all_wells_for_admin.clear()
+    get_all_wells_for_map.clear()
 
+@st.cache_data(ttl=60)
 def get_all_tools_for_management():
     """Gets a simple list of all tools for the management section."""
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT id, part_number, serial_number, description FROM tools ORDER BY part_number", conn)
-    conn.close()
+    with read_conn() as conn:
+        # The whole catalog can be large: Arrow columns avoid one Python object per cell
+        df = pd.read_sql_query("SELECT id, part_number, serial_number, description FROM tools ORDER BY part_number", conn, dtype_backend='pyarrow')
     return df
 
-def delete_tool(tool_id):
-    """Deletes a tool and all its associated movements."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("DELETE FROM inventory_movements WHERE tool_id = ?", (tool_id,))
-        c.execute("DELETE FROM tools WHERE id = ?", (tool_id,))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
-
+def delete_tools(tool_ids):
+    """Deletes a set of tools and all their associated movements in one transaction."""
+    tool_ids_json = json.dumps([int(tool_id) for tool_id in tool_ids])
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("DELETE FROM inventory_movements WHERE tool_id IN (SELECT value FROM json_each(?))", (tool_ids_json,))
+            c.execute("DELETE FROM tool_stock WHERE tool_id IN (SELECT value FROM json_each(?))", (tool_ids_json,))
+            c.execute("DELETE FROM tools WHERE id IN (SELECT value FROM json_each(?))", (tool_ids_json,))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    _invalidate_inventory_caches()
+
+@st.cache_data(ttl=60)
 def get_data_preview_for_reset():
     """Fetches the first 10 rows from tables that will be reset."""
-    conn = sqlite3.connect(DB_NAME)
     preview_data = {}
-    try:
-        preview_data['tools'] = pd.read_sql_query("SELECT * FROM tools LIMIT 10", conn)
-    except Exception as e:
-        st.error(f"Error fetching preview for 'tools': {e}")
-        preview_data['tools'] = pd.DataFrame()
-
-    try:
-        preview_data['inventory_movements'] = pd.read_sql_query("SELECT * FROM inventory_movements LIMIT 10", conn)
-    except Exception as e:
-        st.error(f"Error fetching preview for 'inventory_movements': {e}")
-        preview_data['inventory_movements'] = pd.DataFrame()
-    finally:
-        conn.close()
+    for table in ('tools', 'inventory_movements'):
+        try:
+            preview_data[table] = fetch_df(f"SELECT * FROM {table} LIMIT 10") # Ten rows: fetchall beats read_sql_query's setup cost
+        except Exception as e:
+            st.error(f"Error fetching preview for '{table}': {e}")
+            preview_data[table] = pd.DataFrame()
     return preview_data
 
 
 def reset_all_data():
     """Deletes all tools and inventory movements from the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        c.execute("DELETE FROM inventory_movements")
-        c.execute("DELETE FROM tools")
-        c.execute("DELETE FROM sqlite_sequence WHERE name IN ('tools', 'inventory_movements')")
+    with get_conn() as conn:
+        # get_conn rolls back on any failure, so a partial reset is never committed
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM inventory_movements") # Children first: foreign_keys is ON
+        conn.execute("DELETE FROM tool_stock")
+        conn.execute("DELETE FROM tools")
+        conn.execute("DELETE FROM sqlite_sequence WHERE name IN ('tools', 'inventory_movements')") # Always present: init_db creates AUTOINCREMENT tables
         conn.commit()
-    except sqlite3.OperationalError:
-        conn.commit() 
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    _invalidate_inventory_caches()
 
 # ==============================================================================
 # Módulo: FUNCIONES DE LÓGICA DE NEGOCIO
@@ -449,82 +549,175 @@ def reset_all_data():
 # utilizando las funciones del módulo de base de datos y las procesa para cumplir con los requisitos de la aplicación.
 # Funciones principales:
 # - `add_importation`: Registra la entrada de nuevas herramientas al inventario.
-# - `get_tools_in_location`: Calcula y devuelve el stock disponible de herramientas en una ubicación específica (Almacén, Campo, Instalado), aplicando filtros si es necesario.
+# - `rebuild_stock`: Recalcula la tabla materializada `tool_stock` a partir del historial; los registros de movimientos la actualizan de forma incremental.
+# - `get_tools_in_location`: Lee de `tool_stock` y devuelve el stock disponible de herramientas en una ubicación específica (Almacén, Campo, Instalado), aplicando filtros si es necesario.
 # - `dispatch_tools`: Registra la salida de herramientas del almacén hacia el campo.
 # - `return_tools_batch`: Registra la devolución de herramientas desde el campo al almacén.
-# - `update_field_tool_status`: Cambia el estado de una herramienta en campo (ej. de 'Campo' a 'Instalado').
-# - `get_client_pn`: Obtiene el número de parte del cliente a partir de una equivalencia.
-# - Generación de PDFs: `generate_delivery_note_pdf` y `generate_backload_note_pdf` para crear los documentos de despacho y devolución.
+# - `update_field_tool_status` / `update_field_tool_status_batch`: Cambian el estado de una o varias herramientas en campo (ej. de 'Campo' a 'Instalado') en una sola transacción.
+# - `get_tool_details_by_ids`: Devuelve los detalles de las herramientas junto con su número de parte del cliente (equivalencia).
+# - Generación de PDFs: `generate_delivery_note_pdf` y `generate_backload_note_pdf` para crear los documentos de despacho y devolución; ambos colocan el QR con `draw_qr_code` dibujan la tabla de herramientas con `draw_tools_table` y el pie de firmas con `draw_signature_footer`.
 # - Búsqueda y Reportes: `get_movements_history`, `search_inventory`, `get_full_stock_report`, `get_warehouse_stock_report`, `get_installed_tools_with_details`.
 # ==============================================================================
 
+def _invalidate_inventory_caches():
+    """Drops the cached reports and lookup lists that depend on tools and inventory movements."""
+    get_movements_history.clear()
+    get_full_stock_report.clear()
+    get_warehouse_stock_report.clear()
+    get_tools_in_location.clear()
+    get_installed_tools_with_details.clear()
+    get_wells_in_field.clear()
+    get_all_sales_orders.clear()
+    get_all_wells.clear()
+    get_all_tools_for_management.clear()
+    get_data_preview_for_reset.clear()
+    search_inventory.clear()
+
+# Warehouse, field and installed stock contributed by a set of movements
+STOCK_SUMS_SQL = """
+    SUM(CASE
+        WHEN movement_type IN ('Importation', 'Return') THEN quantity
+        WHEN movement_type = 'Dispatch' THEN -quantity
+        ELSE 0
+    END),
+    SUM(CASE
+        WHEN movement_type = 'Dispatch' THEN quantity
+        WHEN movement_type = 'RevertInstallation' THEN quantity
+        WHEN movement_type IN ('Return', 'Installed') THEN -quantity
+        ELSE 0
+    END),
+    SUM(CASE
+        WHEN movement_type = 'Installed' THEN quantity
+        WHEN movement_type = 'RevertInstallation' THEN -quantity
+        ELSE 0
+    END)
+"""
+
+def _last_movement_id(c):
+    """Returns the id of the newest inventory movement (0 if there are none)."""
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM inventory_movements")
+    return c.fetchone()[0]
+
+def _apply_movements_to_stock(c, after_id):
+    """Adds the movements with id > after_id to tool_stock, in the caller's transaction."""
+    c.execute(f"""
+        INSERT INTO tool_stock (tool_id, well, warehouse_stock, field_stock, installed_stock)
+        SELECT tool_id, COALESCE(well, ''), {STOCK_SUMS_SQL}
+        FROM inventory_movements
+        WHERE id > ?
+        GROUP BY tool_id, COALESCE(well, '')
+        ON CONFLICT(tool_id, well) DO UPDATE SET
+            warehouse_stock = warehouse_stock + excluded.warehouse_stock,
+            field_stock = field_stock + excluded.field_stock,
+            installed_stock = installed_stock + excluded.installed_stock
+    """, (after_id,))
+
+def rebuild_stock():
+    """Recomputes tool_stock from the whole movement history."""
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("DELETE FROM tool_stock")
+            _apply_movements_to_stock(c, 0)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+
 def add_importation(sales_order, responsible, date, tools_to_add):
     """Saves a new importation to the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        for tool_data in tools_to_add:
-            # Find or create the tool definition
-            # For Unique_Tools, check for existing combination of Sales Order, Part Number, and Serial Number
-            if tool_data['tool_type'] == 'Unique_Tools':
-                c.execute("""
-                    SELECT
-                        t.id
-                    FROM tools t
-                    JOIN inventory_movements im ON t.id = im.tool_id
-                    WHERE
-                        t.part_number = ? AND
-                        (t.serial_number = ? OR (t.serial_number IS NULL AND ? IS NULL)) AND
-                        im.sales_order = ? AND
-                        im.movement_type = 'Importation'
-                """, (
-                    tool_data['part_number'],
-                    tool_data.get('serial_number'),
-                    tool_data.get('serial_number'),
-                    sales_order
-                ))
-                if c.fetchone():
-                    raise ValueError(f"Unique Tool with Part Number {tool_data['part_number']}, Serial Number {tool_data.get('serial_number', 'N/A')} and Sales Order {sales_order} already exists.")
-
-            c.execute("SELECT id FROM tools WHERE part_number = ? AND (serial_number = ? OR (serial_number IS NULL AND ? IS NULL))", (tool_data['part_number'], tool_data.get('serial_number'), tool_data.get('serial_number')))
-            tool_id_result = c.fetchone()
-            
-            if tool_id_result:
-                tool_id = tool_id_result[0]
-            else:
-                # Prepare attributes for storage
-                attributes_to_store = {}
-                if 'seat_size' in tool_data and tool_data['seat_size']:
-                    attributes_to_store['seat_size'] = tool_data['seat_size']
-                
-                attributes_json = json.dumps(attributes_to_store) if attributes_to_store else None
-
+    part_numbers = list({tool_data['part_number'] for tool_data in tools_to_add})
+    if not part_numbers:
+        return
+    # Bound as a single JSON array: no host-parameter limit and one SQL text whatever the batch size
+    part_numbers_json = json.dumps(part_numbers)
+
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE") # Take the write lock up front so lookups and inserts see the same data
+            last_id = _last_movement_id(c)
+
+            # Unique_Tools already imported under this Sales Order, fetched in one query
+            c.execute("""
+                SELECT DISTINCT t.part_number, t.serial_number
+                FROM tools t
+                JOIN inventory_movements im ON t.id = im.tool_id
+                WHERE
+                    t.part_number IN (SELECT value FROM json_each(?)) AND
+                    im.sales_order = ? AND
+                    im.movement_type = 'Importation'
+            """, (part_numbers_json, sales_order))
+            imported_keys = set(c.fetchall())
+
+            # Existing tool definitions keyed by (part_number, serial_number)
+            c.execute("SELECT id, part_number, serial_number FROM tools WHERE part_number IN (SELECT value FROM json_each(?))", (part_numbers_json,))
+            tool_ids = {(pn, sn): tool_id for tool_id, pn, sn in c.fetchall()}
+
+            new_tools = {}
+            for tool_data in tools_to_add:
+                key = (tool_data['part_number'], tool_data.get('serial_number'))
+                # For Unique_Tools, check for existing combination of Sales Order, Part Number, and Serial Number
+                if tool_data['tool_type'] == 'Unique_Tools':
+                    if key in imported_keys:
+                        raise ValueError(f"Unique Tool with Part Number {tool_data['part_number']}, Serial Number {tool_data.get('serial_number', 'N/A')} and Sales Order {sales_order} already exists.")
+                    imported_keys.add(key) # Also rejects the same tool twice in one batch
+
+                if key not in tool_ids and key not in new_tools:
+                    # Prepare attributes for storage
+                    attributes_to_store = {}
+                    if 'seat_size' in tool_data and tool_data['seat_size']:
+                        attributes_to_store['seat_size'] = tool_data['seat_size']
+
+                    attributes_json = json.dumps(attributes_to_store) if attributes_to_store else None
+                    new_tools[key] = (
+                        tool_data['part_number'], tool_data.get('serial_number'), tool_data.get('description', ''),
+                        tool_data['tool_type'], tool_data['application'], tool_data['specific_type'], attributes_json
+                    )
+
+            # RETURNING hands back each new id, so no follow-up lookup is needed
+            for key, tool_row in new_tools.items():
                 c.execute("""
                     INSERT INTO tools (part_number, serial_number, description, tool_type, application, specific_type, attributes)
                     VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    tool_data['part_number'], tool_data.get('serial_number'), tool_data.get('description', ''),
-                    tool_data['tool_type'], tool_data['application'], tool_data['specific_type'], attributes_json
-                ))
-                tool_id = c.lastrowid
-            
-            # Record the inventory movement
-            c.execute("""
+                    RETURNING id
+                """, tool_row)
+                tool_ids[key] = c.fetchone()[0]
+
+            # Record the inventory movements
+            c.executemany("""
                 INSERT INTO inventory_movements (tool_id, movement_type, quantity, location, date, responsible, sales_order)
                 VALUES (?, 'Importation', ?, 'Warehouse', ?, ?, ?)
-            """, (tool_id, tool_data.get('quantity', 1), date, responsible, sales_order))
-        
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
-
+            """, [
+                (tool_ids[(tool_data['part_number'], tool_data.get('serial_number'))], tool_data.get('quantity', 1), date, responsible, sales_order)
+                for tool_data in tools_to_add
+            ])
+            _apply_movements_to_stock(c, last_id)
+
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    _invalidate_inventory_caches()
+
+def attributes_label(attributes_json):
+    """Builds the ' [Seat Size: ...] [Receptacle Size: ...]' suffix from a tool's JSON attributes."""
+    if not attributes_json:
+        return ''
+    try:
+        attributes = json.loads(attributes_json)
+    except json.JSONDecodeError:
+        return '' # Ignore malformed JSON
+    label = ''
+    if attributes.get('seat_size'):
+        label += f" [Seat Size: {attributes['seat_size']}]"
+    if attributes.get('receptacle_size'):
+        label += f" [Receptacle Size: {attributes['receptacle_size']}]"
+    return label
+
+@st.cache_data(ttl=60)
 def get_tools_in_location(location, tool_category=None, tool_application=None, tool_specific_type=None, well=None):
     """Recupera herramientas y su stock en una ubicación específica, con filtros opcionales."""
-    conn = sqlite3.connect(DB_NAME)
-    
     # Determine the stock column to filter by
     stock_column = ''
     if location == 'Warehouse':
@@ -534,33 +727,9 @@ def get_tools_in_location(location, tool_category=None, tool_application=None, t
     elif location == 'Installed':
         stock_column = 'installed_stock'
     else:
-        conn.close()
         return []
 
     query = f"""
-    WITH ToolStock AS (
-        SELECT
-            tool_id,
-            well, -- Include well in CTE
-            SUM(CASE 
-                WHEN movement_type IN ('Importation', 'Return') THEN quantity
-                WHEN movement_type = 'Dispatch' THEN -quantity
-                ELSE 0 
-            END) as warehouse_stock,
-            SUM(CASE 
-                WHEN movement_type = 'Dispatch' THEN quantity
-                WHEN movement_type = 'RevertInstallation' THEN quantity
-                WHEN movement_type IN ('Return', 'Installed') THEN -quantity
-                ELSE 0 
-            END) as field_stock,
-            SUM(CASE
-                WHEN movement_type = 'Installed' THEN quantity
-                WHEN movement_type = 'RevertInstallation' THEN -quantity
-                ELSE 0
-            END) as installed_stock
-        FROM inventory_movements
-        GROUP BY tool_id, well -- Group by well as well
-    )
     SELECT 
         t.id, 
         t.part_number, 
@@ -570,13 +739,11 @@ def get_tools_in_location(location, tool_category=None, tool_application=None, t
         t.tool_type,
         t.application,
         t.attributes,
-        COALESCE(ts.warehouse_stock, 0) as warehouse_stock,
-        COALESCE(ts.field_stock, 0) as field_stock,
-        COALESCE(ts.installed_stock, 0) as installed_stock,
-        ts.well -- Select well from CTE
+        ts.{stock_column}, -- Only the location's own stock is used
+        NULLIF(ts.well, '') as well
     FROM tools t
-    LEFT JOIN ToolStock ts ON t.id = ts.tool_id
-    WHERE t.is_active = 1 AND COALESCE(ts.{stock_column}, 0) > 0
+    JOIN tool_stock ts ON t.id = ts.tool_id
+    WHERE t.is_active = 1 AND ts.{stock_column} > 0
     """
     
     params = []
@@ -593,254 +760,171 @@ def get_tools_in_location(location, tool_category=None, tool_application=None, t
         query += " AND ts.well = ?"
         params.append(well)
 
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
+    df = fetch_df(query, params)
 
-    stock_list = []
-    
-    for index, row in df.iterrows():
-        current_stock = row[stock_column]
-        if current_stock > 0:
-            serial_number_for_dict = row['serial_number']
-            if pd.isna(serial_number_for_dict) or str(serial_number_for_dict).strip() == '':
-                serial_number_for_dict = None
-
-            if row['tool_type'] == 'Unique_Tools':
-                display_name = f"{row['description']} / PN: {row['part_number']} / SN: {serial_number_for_dict if serial_number_for_dict else 'N/A'} / {row['specific_type']}"
-                
-                # Add seat_size to display_name if available
-                if row['attributes']:
-                    try:
-                        attributes = json.loads(row['attributes'])
-                        if 'seat_size' in attributes and attributes['seat_size']:
-                            display_name += f" [Seat Size: {attributes['seat_size']}]"
-                        if 'receptacle_size' in attributes and attributes['receptacle_size']:
-                            display_name += f" [Receptacle Size: {attributes['receptacle_size']}]"
-                    except json.JSONDecodeError:
-                        pass # Handle malformed JSON if necessary
-
-                quantity = 1
-            else: # Miscelaneous
-                display_name = f"{row['description']} / PN: {row['part_number']} / SN: N/A / {row['specific_type']}"
-                
-                # Add seat_size to display_name if available (though less likely for misc)
-                if row['attributes']:
-                    try:
-                        attributes = json.loads(row['attributes'])
-                        if 'seat_size' in attributes and attributes['seat_size']:
-                            display_name += f" [Seat Size: {attributes['seat_size']}]"
-                        if 'receptacle_size' in attributes and attributes['receptacle_size']:
-                            display_name += f" [Receptacle Size: {attributes['receptacle_size']}]"
-                    except json.JSONDecodeError:
-                        pass # Handle malformed JSON if necessary
-
-                display_name += f" - Stock: {int(current_stock)}"
-                quantity = int(current_stock)
-            
-            stock_list.append({
-                "id": row['id'],
-                "display_name": display_name,
-                "type": row['tool_type'],
-                "quantity": quantity,
-                "application": row['application'],
-                "specific_type": row['specific_type'],
-                "part_number": row['part_number'],
-                "serial_number": serial_number_for_dict, # Add serial_number here
-                "well": row['well'] 
-            })
-            
-    return stock_list
+    if df.empty:
+        return []
+
+    serial_numbers = df['serial_number'].astype(object)
+    has_serial = serial_numbers.notna() & (serial_numbers.astype(str).str.strip() != '')
+    serial_numbers = serial_numbers.where(has_serial, None)
+    is_unique = df['tool_type'] == 'Unique_Tools'
+    # Few distinct attribute payloads (seat sizes) repeat across many rows: parse each JSON string once
+    attribute_labels = {attributes_json: attributes_label(attributes_json) for attributes_json in df['attributes'].dropna().unique()}
+
+    # Unique_Tools are listed one per row; Miscelaneous show their stock in the label
+    quantities = df[stock_column].astype(int).where(~is_unique, 1)
+    shown_serials = serial_numbers.where(is_unique & has_serial, 'N/A').astype(str)
+    base_names = (
+        df['description'].astype(str) + ' / PN: ' + df['part_number'].astype(str)
+        + ' / SN: ' + shown_serials + ' / ' + df['specific_type'].astype(str)
+        + df['attributes'].map(attribute_labels).fillna('').astype(str)
+    )
+    display_names = base_names.where(is_unique, base_names + ' - Stock: ' + quantities.astype(str))
+
+    stock_df = pd.DataFrame({
+        "id": df['id'],
+        "display_name": display_names,
+        "base_name": base_names, # Label without the stock suffix, for relabelling and list entries
+        "type": df['tool_type'],
+        "quantity": quantities,
+        "application": df['application'],
+        "specific_type": df['specific_type'],
+        "part_number": df['part_number'],
+        "serial_number": serial_numbers,
+        "well": df['well']
+    })
+    return stock_df.to_dict('records')
 
 
 def dispatch_tools(tools_to_dispatch, responsible, date, well):
     """Registra la salida de herramientas del almacén a campo."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        for tool in tools_to_dispatch:
-            c.execute("""
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            last_id = _last_movement_id(c)
+            c.executemany("""
                 INSERT INTO inventory_movements (tool_id, movement_type, quantity, location, date, responsible, well)
                 VALUES (?, 'Dispatch', ?, 'Field', ?, ?, ?)
-            """, (
-                tool['id'],
-                tool['quantity_to_dispatch'],
-                date,
-                responsible,
-                well
-            ))
-        conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+            """, [
+                (tool['id'], tool['quantity_to_dispatch'], date, responsible, well)
+                for tool in tools_to_dispatch
+            ])
+            _apply_movements_to_stock(c, last_id)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    _invalidate_inventory_caches()
 
 def return_tools_batch(tools_to_return, responsible, date):
     """Registers the return of a batch of tools from the field."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    try:
-        for tool_data in tools_to_return:
-            tool_id = tool_data['id']
-            quantity = int(tool_data.get('quantity', 1))
-            well = tool_data.get('well') # Get well from tool_data
-
-            c.execute("""
+    with get_conn() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            last_id = _last_movement_id(c)
+            c.executemany("""
                 INSERT INTO inventory_movements (tool_id, movement_type, quantity, location, date, responsible, well)
                 VALUES (?, 'Return', ?, 'Warehouse', ?, ?, ?)
-            """, (tool_id, quantity, date, responsible, well))
+            """, [
+                (tool_data['id'], int(tool_data.get('quantity', 1)), date, responsible, tool_data.get('well'))
+                for tool_data in tools_to_return
+            ])
+            _apply_movements_to_stock(c, last_id)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+    _invalidate_inventory_caches()
+
+# new_status -> (movement_type, location) for field status changes
+FIELD_STATUS_MOVEMENTS = {
+    'Installed': ('Installed', 'Installed'),
+    'Returned': ('Return', 'Warehouse'),
+    'RevertInstallation': ('RevertInstallation', 'Field'), # Specific type for reversal; it goes back to the Field
+}
+
+def update_field_tool_status_batch(updates):
+    """Registers several (tool_id, new_status, responsible, date, quantity) status changes in one transaction."""
+    rows = [
+        (tool_id, *FIELD_STATUS_MOVEMENTS[new_status], quantity, date, responsible)
+        for tool_id, new_status, responsible, date, quantity in updates
+        if new_status in FIELD_STATUS_MOVEMENTS # Unknown statuses are ignored
+    ]
+    if not rows:
+        return
+
+    with get_conn() as conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        last_id = _last_movement_id(c)
+        c.executemany("""
+            INSERT INTO inventory_movements (tool_id, movement_type, location, quantity, date, responsible)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+        _apply_movements_to_stock(c, last_id)
         conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
+    _invalidate_inventory_caches()
 
 def update_field_tool_status(tool_id, new_status, responsible, date, quantity=1):
     """Actualiza el estado de una herramienta en campo o revierte una instalación."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    
-    if new_status == 'Installed':
-        movement_type = 'Installed'
-        location = 'Installed'
-    elif new_status == 'Returned':
-        movement_type = 'Return'
-        location = 'Warehouse'
-    elif new_status == 'RevertInstallation':
-        movement_type = 'RevertInstallation' # Specific type for reversal
-        location = 'Field'                  # It goes back to the Field
-    else:
-        conn.close()
-        return # Do nothing if status is unknown
-
-    c.execute("""
-        INSERT INTO inventory_movements (tool_id, movement_type, quantity, location, date, responsible)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (tool_id, movement_type, quantity, location, date, responsible))
-    conn.commit()
-    conn.close()
-
-def get_client_pn(supplier_pn):
-    """Retrieves the client Part Number for a given supplier Part Number."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT client_pn, client_description FROM part_number_equivalences WHERE supplier_pn = ?", (supplier_pn,))
-    result = c.fetchone()
-    conn.close()
-    return result if result else (None, None)
-
-def generate_delivery_note_pdf(doc_number, contract_number, client, well, responsible, dispatch_date, tools_data):
-    """Generates a Delivery Note PDF with specified details and tool list."""
-    pdf = FPDF('P', 'mm', 'A4')
-    pdf.set_auto_page_break(True, margin=15)
-    pdf.add_page()
-
-    # QR Code Data
-    qr_content = {
-        "client": client,
-        "well": well,
-        "tools": []
-    }
-    for tool in tools_data:
-        full_tool_details = get_tool_details_by_id(tool['id'])
-        if full_tool_details:
-            qr_content["tools"].append({
-                "Part Number": full_tool_details['part_number'],
-                "Serial Number": full_tool_details['serial_number'] if full_tool_details['serial_number'] else 'N/A',
-                "Description": full_tool_details['description'],
-                "Quantity": tool['quantity_to_dispatch']
-            })
-
-    qr_image_bytes = generate_qr_code(qr_content)
-    
-    # Save QR code to a temporary file and embed it
+    update_field_tool_status_batch([(tool_id, new_status, responsible, date, quantity)])
+
+def client_pn_line(client_pn_data):
+    """Builds the 'Client PN: ... - Client Desc: ...' line from a (client_pn, client_description) pair ('' if none)."""
+    client_pn, client_description = client_pn_data
+    client_line = ""
+    if client_pn:
+        client_line += f"Client PN: {client_pn}"
+    if client_description:
+        if client_line: client_line += " - "
+        client_line += f"Client Desc: {client_description}"
+    return client_line
+
+def draw_qr_code(pdf, qr_content):
+    """Places the QR code for qr_content in the top-right corner of the current page."""
     import tempfile
     import os
-    temp_qr_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    temp_qr_file.write(qr_image_bytes.getvalue())
-    temp_qr_file.close() # Explicitly close the file
-    temp_qr_file_path = temp_qr_file.name
-    pdf.image(temp_qr_file_path, x=170, y=10, w=30)
-    os.unlink(temp_qr_file_path) # Manually delete the file
-
-    # Title
-    pdf.set_font('Arial', 'B', 16)
-    pdf.cell(0, 10, 'Delivery Note', 0, 1, 'C')
+    # Classic fpdf only reads images from a path, so the PNG goes through a temporary file
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_qr_file:
+        temp_qr_file.write(qr_png_bytes(json.dumps(qr_content))) # Cached PNG bytes, written without an intermediate BytesIO
+    try:
+        pdf.image(temp_qr_file.name, x=170, y=10, w=30)
+    finally:
+        os.unlink(temp_qr_file.name) # Removed even if fpdf fails to read it
 
-    # General Information
-    pdf.set_font('Arial', '', 10)
-    pdf.cell(0, 7, f'Client: {client}', 0, 1)
-    pdf.cell(0, 7, f'Date: {dispatch_date}', 0, 1)
-    pdf.cell(0, 7, f'Responsible: {responsible}', 0, 1)
-    pdf.cell(0, 7, f'Document Number: {doc_number}', 0, 1)
-    pdf.cell(0, 7, f'Contract Number: {contract_number}', 0, 1)
-    pdf.cell(0, 7, f'Well: {well}', 0, 1)
-    pdf.ln(10)
+def draw_tools_table(pdf, rows):
+    """Draws the Item # / Tool Description / Quantity table from preformatted (description, quantity) rows."""
+    # Column layout, computed once for the whole table
+    w_item, w_desc, w_qty = 20, 130, 40
+    line_height = 5
+    row_height = line_height * 2 # Always 2 lines for description
 
     # Table Header
     pdf.set_font('Arial', 'B', 10)
-    pdf.cell(20, 10, 'Item #', 1, 0, 'C')
-    pdf.cell(130, 10, 'Tool Description', 1, 0, 'C')
-    pdf.cell(40, 10, 'Quantity', 1, 1, 'C')
+    pdf.cell(w_item, 10, 'Item #', 1, 0, 'C')
+    pdf.cell(w_desc, 10, 'Tool Description', 1, 0, 'C')
+    pdf.cell(w_qty, 10, 'Quantity', 1, 1, 'C')
 
     # Table Rows
     pdf.set_font('Arial', '', 9)
-    item_num = 1
-    for tool in tools_data:
-        full_tool_details = get_tool_details_by_id(tool['id'])
-        
-        supplier_line = f"{full_tool_details['description']} / PN: {full_tool_details['part_number']} / SN: {full_tool_details['serial_number'] if full_tool_details['serial_number'] else 'N/A'}"
-        
-        client_pn_data = get_client_pn(tool['part_number'])
-        client_pn = client_pn_data[0] if client_pn_data else None
-        client_description = client_pn_data[1] if client_pn_data else None
-        
-        client_line = ""
-        if client_pn:
-            client_line += f"Client PN: {client_pn}"
-        if client_description:
-            if client_line: client_line += " - "
-            client_line += f"Client Desc: {client_description}"
-
-        line_height = 5
-        cell_width = 130
-        
-        full_description_text = supplier_line
-        if client_line:
-            full_description_text += "\n" + client_line
-
-        # Calculate the height needed for the multi-line description cell
-        # This is an approximation, FPDF doesn't have a direct way to get multi_cell height without drawing.
-        # A common workaround is to estimate based on string width and cell width.
-        # For two lines, we can simply set it to line_height * 2
-        row_height = line_height * 2 # Always 2 lines for description
-
-        # Store current X and Y
-        start_x = pdf.get_x()
+    x_qty = pdf.l_margin + w_item + w_desc # Every row starts at the left margin
+    for item_num, (description_text, quantity) in enumerate(rows, start=1):
+        # The item cell leaves the cursor right of it, on a new page if it triggered a page break
+        pdf.cell(w_item, row_height, str(item_num), 1, 0, 'C')
         start_y = pdf.get_y()
 
-        # Draw Item #
-        pdf.cell(20, row_height, str(item_num), 1, 0, 'C')
+        # Description (multi-line) next to the item number
+        pdf.multi_cell(w_desc, line_height, description_text, 1, 'L', 0)
 
-        # Draw Description (multi-line)
-        # Move to the description column's X position
-        pdf.set_xy(start_x + 20, start_y)
-        pdf.multi_cell(cell_width, line_height, full_description_text, 1, 'L', 0)
-        
-        # Draw Quantity
-        # Move to the quantity column's X position, and back to the start_y
-        pdf.set_xy(start_x + 20 + cell_width, start_y)
-        pdf.cell(40, row_height, str(tool['quantity_to_dispatch']), 1, 0, 'C')
+        # Quantity, back on the row's first line; ln=1 moves below the row at the left margin
+        pdf.set_xy(x_qty, start_y)
+        pdf.cell(w_qty, row_height, quantity, 1, 1, 'C')
 
-        # Move to the next line, ensuring it's below the tallest cell
-        pdf.set_y(start_y + row_height)
-
-        item_num += 1
-
-    pdf.ln(10)
-
-    # Footer / Signature Section
+def draw_signature_footer(pdf, received_for):
+    """Draws the two signature boxes at the bottom of the page, with the 'For: ...' receiver block on the right."""
     pdf.set_font('Arial', '', 10)
 
     # Calculate starting Y position for the footer to be at the bottom of the page
@@ -865,7 +949,7 @@ def generate_delivery_note_pdf(doc_number, contract_number, client, well, respon
     text_start_y_right_box = start_y_footer + 5 # 5mm padding from top edge of right box
     
     pdf.set_xy(text_start_x_right_box, text_start_y_right_box)
-    pdf.cell(0, 7, f'For: {client}', 0, 1, 'L')
+    pdf.cell(0, 7, f'For: {received_for}', 0, 1, 'L')
     pdf.set_x(text_start_x_right_box) # Reset X for next line
     pdf.cell(0, 7, 'Received by:', 0, 1, 'L')
     pdf.set_x(text_start_x_right_box) # Reset X for next line
@@ -877,13 +961,69 @@ def generate_delivery_note_pdf(doc_number, contract_number, client, well, respon
     pdf.set_x(text_start_x_right_box) # Reset X for next line
     pdf.cell(0, 7, 'Seal:', 0, 1, 'L')
 
-    # Removed pdf.ln(2) here to prevent pushing content outside the box
+def generate_delivery_note_pdf(doc_number, contract_number, client, well, responsible, dispatch_date, tools_data):
+    """Generates a Delivery Note PDF with specified details and tool list."""
+    from fpdf import FPDF
+    pdf = FPDF('P', 'mm', 'A4')
+    pdf.set_auto_page_break(True, margin=15)
+    pdf.add_page()
+
+    # QR Code Data
+    qr_content = {
+        "client": client,
+        "well": well,
+        "tools": []
+    }
+    tool_details = get_tool_details_by_ids([tool['id'] for tool in tools_data])
+    for tool in tools_data:
+        full_tool_details = tool_details.get(tool['id'])
+        if full_tool_details:
+            qr_content["tools"].append({
+                "Part Number": full_tool_details['part_number'],
+                "Serial Number": full_tool_details['serial_number'] if full_tool_details['serial_number'] else 'N/A',
+                "Description": full_tool_details['description'],
+                "Quantity": tool['quantity_to_dispatch']
+            })
+
+    draw_qr_code(pdf, qr_content)
+
+    # Title
+    pdf.set_font('Arial', 'B', 16)
+    pdf.cell(0, 10, 'Delivery Note', 0, 1, 'C')
+
+    # General Information
+    pdf.set_font('Arial', '', 10)
+    pdf.cell(0, 7, f'Client: {client}', 0, 1)
+    pdf.cell(0, 7, f'Date: {dispatch_date}', 0, 1)
+    pdf.cell(0, 7, f'Responsible: {responsible}', 0, 1)
+    pdf.cell(0, 7, f'Document Number: {doc_number}', 0, 1)
+    pdf.cell(0, 7, f'Contract Number: {contract_number}', 0, 1)
+    pdf.cell(0, 7, f'Well: {well}', 0, 1)
+    pdf.ln(10)
+
+    # Preformat every row once, reusing the tool details (and client PNs) already fetched for the QR
+    rows = []
+    for tool in tools_data:
+        details = tool_details[tool['id']]
+        full_description_text = f"{details['description']} / PN: {details['part_number']} / SN: {details['serial_number'] if details['serial_number'] else 'N/A'}"
+        client_line = client_pn_line((details['client_pn'], details['client_description']))
+        if client_line:
+            full_description_text += "\n" + client_line
+        rows.append((full_description_text, str(tool['quantity_to_dispatch'])))
+
+    draw_tools_table(pdf, rows)
+
+    pdf.ln(10)
+
+    # Footer / Signature Section
+    draw_signature_footer(pdf, client)
 
     return pdf.output(dest='S').encode('latin1')
 
 
 def generate_backload_note_pdf(doc_number, responsible, return_date, tools_data):
     """Generates a Backload Note PDF with specified details and tool list."""
+    from fpdf import FPDF
     pdf = FPDF('P', 'mm', 'A4')
     pdf.set_auto_page_break(True, margin=15)
     pdf.add_page()
@@ -894,8 +1034,9 @@ def generate_backload_note_pdf(doc_number, responsible, return_date, tools_data)
         "well": "N/A",   # Placeholder as well is not captured in return
         "tools": []
     }
+    tool_details = get_tool_details_by_ids([tool['id'] for tool in tools_data])
     for tool in tools_data:
-        full_tool_details = get_tool_details_by_id(tool['id'])
+        full_tool_details = tool_details.get(tool['id'])
         if full_tool_details:
             qr_content["tools"].append({
                 "Part Number": full_tool_details['part_number'],
@@ -904,17 +1045,7 @@ def generate_backload_note_pdf(doc_number, responsible, return_date, tools_data)
                 "Quantity": tool['quantity']
             })
 
-    qr_image_bytes = generate_qr_code(qr_content)
-
-    # Save QR code to a temporary file and embed it
-    import tempfile
-    import os
-    temp_qr_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    temp_qr_file.write(qr_image_bytes.getvalue())
-    temp_qr_file.close() # Explicitly close the file
-    temp_qr_file_path = temp_qr_file.name
-    pdf.image(temp_qr_file_path, x=170, y=10, w=30)
-    os.unlink(temp_qr_file_path) # Manually delete the file
+    draw_qr_code(pdf, qr_content)
 
     # Title
     pdf.set_font('Arial', 'B', 16)
@@ -927,132 +1058,29 @@ def generate_backload_note_pdf(doc_number, responsible, return_date, tools_data)
     pdf.cell(0, 7, f'Date: {return_date}', 0, 1)
     pdf.ln(10)
 
-    # Table Header
-    pdf.set_font('Arial', 'B', 10)
-    pdf.cell(20, 10, 'Item #', 1, 0, 'C')
-    pdf.cell(130, 10, 'Tool Description', 1, 0, 'C')
-    pdf.cell(40, 10, 'Quantity', 1, 1, 'C')
-
-    # Table Rows
-    pdf.set_font('Arial', '', 9)
-    item_num = 1
+    # Preformat every row once, reusing the tool details (and client PNs) already fetched for the QR
+    rows = []
     for tool in tools_data:
-        full_tool_details = get_tool_details_by_id(tool['id'])
-
-        supplier_line = f"{full_tool_details['description']} / PN: {full_tool_details['part_number']}"
-        
-        client_pn_data = get_client_pn(tool['part_number'])
-        client_pn = client_pn_data[0] if client_pn_data else None
-        client_description = client_pn_data[1] if client_pn_data else None
-        
-        client_line = ""
-        if client_pn:
-            client_line += f"Client PN: {client_pn}"
-        if client_description:
-            if client_line: client_line += " - "
-            client_line += f"Client Desc: {client_description}"
-
-        line_height = 5
-        cell_width = 130
-
-        full_description_text = supplier_line
+        details = tool_details[tool['id']]
+        full_description_text = f"{details['description']} / PN: {details['part_number']}"
+        client_line = client_pn_line((details['client_pn'], details['client_description']))
         if client_line:
             full_description_text += "\n" + client_line
+        rows.append((full_description_text, str(tool['quantity'])))
 
-        # Calculate the height needed for the multi-line description cell
-        row_height = line_height * 2 # Always 2 lines for description
-
-        # Store current X and Y
-        start_x = pdf.get_x()
-        start_y = pdf.get_y()
-
-        # Draw Item #
-        pdf.cell(20, row_height, str(item_num), 1, 0, 'C')
-
-        # Draw Description (multi-line)
-        pdf.set_xy(start_x + 20, start_y)
-        pdf.multi_cell(cell_width, line_height, full_description_text, 1, 'L', 0)
-        
-        # Draw Quantity
-        pdf.set_xy(start_x + 20 + cell_width, start_y)
-        pdf.cell(40, row_height, str(tool['quantity']), 1, 0, 'C')
-
-        # Move to the next line, ensuring it's below the tallest cell
-        pdf.set_y(start_y + row_height)
-
-        item_num += 1
-
-    pdf.ln(10)
-
-    # Footer / Signature Section
-    pdf.set_font('Arial', '', 10)
-
-    # Calculate starting Y position for the footer to be at the bottom of the page
-    footer_height = 50 # Height of the boxes (increased to accommodate all text)
-    start_y_footer = pdf.h - pdf.b_margin - footer_height
-    pdf.set_y(start_y_footer)
-
-    page_width = pdf.w
-    margin = 15
-    box_width = (page_width - 2 * margin) / 2
-    box_height = footer_height
+    draw_tools_table(pdf, rows)
 
-    # Draw left box
-    pdf.rect(margin, start_y_footer, box_width, box_height)
-
-    # Draw right box
-    pdf.rect(margin + box_width, start_y_footer, box_width, box_height)
-
-    # Set position for text in the right box
-    # Move to the start of the right box, with a small internal padding
-    text_start_x_right_box = margin + box_width + 5 # 5mm padding from left edge of right box
-    text_start_y_right_box = start_y_footer + 5 # 5mm padding from top edge of right box
-    
     pdf.ln(10)
 
     # Footer / Signature Section
-    pdf.set_font('Arial', '', 10)
-
-    # Calculate starting Y position for the footer to be at the bottom of the page
-    footer_height = 50 # Height of the boxes (increased to accommodate all text)
-    start_y_footer = pdf.h - pdf.b_margin - footer_height
-    pdf.set_y(start_y_footer)
-
-    page_width = pdf.w
-    margin = 15
-    box_width = (page_width - 2 * margin) / 2
-    box_height = footer_height
-
-    # Draw left box
-    pdf.rect(margin, start_y_footer, box_width, box_height)
-
-    # Draw right box
-    pdf.rect(margin + box_width, start_y_footer, box_width, box_height)
-
-    # Set position for text in the right box
-    # Move to the start of the right box, with a small internal padding
-    text_start_x_right_box = margin + box_width + 5 # 5mm padding from left edge of right box
-    text_start_y_right_box = start_y_footer + 5 # 5mm padding from top edge of right box
-    
-    pdf.set_xy(text_start_x_right_box, text_start_y_right_box)
-    pdf.cell(0, 7, 'For: PDO (Petroleum Development Oman)', 0, 1, 'L')
-    pdf.set_x(text_start_x_right_box) # Reset X for next line
-    pdf.cell(0, 7, 'Received by:', 0, 1, 'L')
-    pdf.set_x(text_start_x_right_box) # Reset X for next line
-    pdf.cell(0, 7, 'Name:', 0, 1, 'L')
-    pdf.set_x(text_start_x_right_box) # Reset X for next line
-    pdf.cell(0, 7, 'Contact Number:', 0, 1, 'L')
-    pdf.set_x(text_start_x_right_box) # Reset X for next line
-    pdf.cell(0, 7, 'Signature:', 0, 1, 'L')
-    pdf.set_x(text_start_x_right_box) # Reset X for next line
-    pdf.cell(0, 7, 'Seal:', 0, 1, 'L')
+    draw_signature_footer(pdf, 'PDO (Petroleum Development Oman)')
 
     return pdf.output(dest='S').encode('latin1')
 
 
+@st.cache_data(ttl=60)
 def get_movements_history(start_date, end_date):
     """Obtiene el historial de movimientos en un rango de fechas."""
-    conn = sqlite3.connect(DB_NAME)
     query = """
         SELECT im.date, im.movement_type, t.part_number, t.serial_number, im.quantity, im.location, im.responsible, im.sales_order, im.well
         FROM inventory_movements im
@@ -1060,14 +1088,14 @@ def get_movements_history(start_date, end_date):
         WHERE im.date BETWEEN ? AND ?
         ORDER BY im.date DESC
     """
-    df = pd.read_sql_query(query, conn, params=(start_date, end_date))
-    conn.close()
+
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn, params=(start_date, end_date), dtype_backend='pyarrow') # Arrow strings instead of object arrays
     return df
 
+@st.cache_data(ttl=30, max_entries=64) # Repeated searches with the same filters reuse the result
 def search_inventory(query_term=None, sales_order_filter=None, well_filter=None):
     """Searches for tools based on a query term and/or filters across multiple fields."""
-    conn = sqlite3.connect(DB_NAME)
-    
     base_query = """
         SELECT
             t.part_number,
@@ -1080,24 +1108,25 @@ def search_inventory(query_term=None, sales_order_filter=None, well_filter=None)
             im.well,
             latest_import.sales_order
         FROM tools t
-        JOIN (
-            SELECT tool_id, MAX(id) as max_id
-            FROM inventory_movements
-            GROUP BY tool_id
-        ) AS latest_im ON t.id = latest_im.tool_id
-        JOIN inventory_movements im ON latest_im.max_id = im.id
-        LEFT JOIN (
-            SELECT tool_id, sales_order, MAX(id) as max_import_id
-            FROM inventory_movements
-            WHERE movement_type = 'Importation'
-            GROUP BY tool_id
-        ) AS latest_import ON t.id = latest_import.tool_id
+        -- Latest movement and latest importation per tool, each found by an index seek on that tool's movements,
+        -- so a narrow search only touches the matching tools instead of aggregating the whole table
+        JOIN inventory_movements im ON im.id = (
+            SELECT MAX(id) FROM inventory_movements WHERE tool_id = t.id
+        )
+        LEFT JOIN inventory_movements latest_import ON latest_import.id = (
+            SELECT MAX(id) FROM inventory_movements WHERE tool_id = t.id AND movement_type = 'Importation'
+        )
     """
 
     conditions = []
     params = []
 
-    if query_term:
+    if query_term and len(query_term) >= 3:
+        # Trigram FTS matches substrings like LIKE '%term%' but through the index
+        conditions.append("t.id IN (SELECT rowid FROM tools_fts WHERE tools_fts MATCH ?)")
+        params.append('"' + query_term.replace('"', '""') + '"')
+    elif query_term:
+        # Trigrams need at least 3 characters; shorter terms fall back to LIKE
         like_term = f"%{query_term}%"
         conditions.append("(t.part_number LIKE ? OR t.serial_number LIKE ? OR t.description LIKE ?)")
         params.extend([like_term, like_term, like_term])
@@ -1112,38 +1141,23 @@ def search_inventory(query_term=None, sales_order_filter=None, well_filter=None)
 
     if conditions:
         base_query += " WHERE " + " AND ".join(conditions)
-    
-    df = pd.read_sql_query(base_query, conn, params=params)
-    conn.close()
+
+    with read_conn() as conn:
+        df = pd.read_sql_query(base_query, conn, params=params)
     return df
 
+@st.cache_data(ttl=60)
 def get_full_stock_report():
     """Gets a DataFrame with the current stock of all tools in all locations."""
-    conn = sqlite3.connect(DB_NAME)
-    
     query = """
         WITH ToolStock AS (
             SELECT
                 tool_id,
-                SUM(CASE 
-                    WHEN movement_type IN ('Importation', 'Return') THEN quantity
-                    WHEN movement_type = 'Dispatch' THEN -quantity
-                    ELSE 0 
-                END) as warehouse_stock,
-                SUM(CASE 
-                    WHEN movement_type = 'Dispatch' THEN quantity
-                    WHEN movement_type = 'RevertInstallation' THEN quantity
-                    WHEN movement_type IN ('Return', 'Installed') THEN -quantity
-                    ELSE 0 
-                END) as field_stock,
-                SUM(CASE
-                    WHEN movement_type = 'Installed' THEN quantity
-                    WHEN movement_type = 'RevertInstallation' THEN -quantity
-                    ELSE 0
-                END) as installed_stock
-            FROM inventory_movements
+                SUM(warehouse_stock) as warehouse_stock,
+                SUM(field_stock) as field_stock
+            FROM tool_stock
             GROUP BY tool_id
-            HAVING (COALESCE(warehouse_stock, 0) + COALESCE(field_stock, 0)) > 0
+            HAVING SUM(warehouse_stock + field_stock) > 0 -- tool_stock counters are NOT NULL, so no COALESCE is needed
         )
         SELECT 
             t.part_number, 
@@ -1151,16 +1165,16 @@ def get_full_stock_report():
             t.description,
             t.specific_type, 
             t.tool_type,
-            COALESCE(ts.warehouse_stock, 0) as warehouse_stock,
-            COALESCE(ts.field_stock, 0) as field_stock
+            ts.warehouse_stock,
+            ts.field_stock
         FROM tools t
         JOIN ToolStock ts ON t.id = ts.tool_id
         WHERE t.is_active = 1
         ORDER BY t.part_number, t.serial_number
     """
-    
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn, dtype_backend='pyarrow')
     
     # Rename columns for better readability in the report
     df.rename(columns={
@@ -1175,21 +1189,15 @@ def get_full_stock_report():
     
     return df
 
+@st.cache_data(ttl=60)
 def get_warehouse_stock_report():
     """Gets a DataFrame with the current stock of tools in the warehouse."""
-    conn = sqlite3.connect(DB_NAME)
-    
     query = """
         WITH ToolStock AS (
-            SELECT
-                tool_id,
-                SUM(CASE 
-                    WHEN movement_type IN ('Importation', 'Return') THEN quantity
-                    WHEN movement_type = 'Dispatch' THEN -quantity
-                    ELSE 0 
-                END) as warehouse_stock
-            FROM inventory_movements
+            SELECT tool_id, SUM(warehouse_stock) as warehouse_stock
+            FROM tool_stock
             GROUP BY tool_id
+            HAVING SUM(warehouse_stock) > 0
         )
         SELECT 
             t.part_number, 
@@ -1197,15 +1205,15 @@ def get_warehouse_stock_report():
             t.description,
             t.specific_type, 
             t.tool_type,
-            COALESCE(ts.warehouse_stock, 0) as warehouse_stock
+            ts.warehouse_stock
         FROM tools t
-        LEFT JOIN ToolStock ts ON t.id = ts.tool_id
-        WHERE t.is_active = 1 AND COALESCE(ts.warehouse_stock, 0) > 0
+        JOIN ToolStock ts ON t.id = ts.tool_id
+        WHERE t.is_active = 1
         ORDER BY t.part_number, t.serial_number
     """
-    
-    df = pd.read_sql_query(query, conn)
-    conn.close()
+
+    with read_conn() as conn:
+        df = pd.read_sql_query(query, conn)
     
     # Rename columns for better readability in the report
     df.rename(columns={
@@ -1219,31 +1227,25 @@ def get_warehouse_stock_report():
     
     return df
 
-def get_installed_tools_with_details():
-    """Gets detailed information for all currently installed tools."""
-    conn = sqlite3.connect(DB_NAME)
+@st.cache_data(ttl=60)
+def get_installed_tools_with_details(after_id=0, limit=-1):
+    """Gets detailed information for installed tools with id > after_id, in id order, at most limit of them (-1: all)."""
     query = """
-        WITH ToolStock AS (
-            SELECT
-                tool_id,
-                SUM(CASE
-                    WHEN movement_type = 'Installed' THEN quantity
-                    WHEN movement_type = 'RevertInstallation' THEN -quantity
-                    ELSE 0
-                END) as installed_stock
-            FROM inventory_movements
+        -- Keyset page: tool_stock's key leads with tool_id, so the scan starts at after_id and stops after limit tools,
+        -- and the per-tool lookups below only run for that page
+        WITH InstalledTools AS (
+            SELECT tool_id, SUM(installed_stock) as installed_stock
+            FROM tool_stock
+            WHERE tool_id > ?
             GROUP BY tool_id
-        ),
-        InstalledTools AS (
-            SELECT tool_id, installed_stock
-            FROM ToolStock
-            WHERE installed_stock > 0
+            HAVING SUM(installed_stock) > 0
+            ORDER BY tool_id
+            LIMIT ?
         )
         SELECT
             it.tool_id as id,
             t.part_number,
             t.serial_number,
-            t.description,
             t.specific_type,
             t.tool_type,
             it.installed_stock as quantity,
@@ -1251,51 +1253,79 @@ def get_installed_tools_with_details():
             (SELECT well FROM inventory_movements im_well WHERE im_well.tool_id = it.tool_id AND im_well.movement_type = 'Dispatch' AND im_well.well IS NOT NULL ORDER BY im_well.id DESC LIMIT 1) as well
         FROM InstalledTools it
         JOIN tools t ON it.tool_id = t.id
+        ORDER BY it.tool_id
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df.to_dict('records')
 
+    with read_conn() as conn:
+        c = conn.cursor()
+        c.row_factory = sqlite3.Row
+        rows = c.execute(query, (after_id, limit)).fetchall()
+    return [dict(row) for row in rows] # Records straight from the cursor, no intermediate DataFrame
+
+@st.cache_data(ttl=60)
 def get_wells_in_field():
     """Gets a list of unique well names where tools are currently in the 'Field' location (i.e., have positive field stock)."""
-    conn = sqlite3.connect(DB_NAME)
     query = """
-    WITH WellFieldStock AS (
-        SELECT
-            well,
-            SUM(CASE
-                WHEN movement_type = 'Dispatch' THEN quantity
-                WHEN movement_type IN ('Return', 'Installed') THEN -quantity
-                ELSE 0
-            END) as current_field_stock
-        FROM inventory_movements
-        WHERE well IS NOT NULL AND well != ''
-        GROUP BY well
-        HAVING current_field_stock > 0
-    )
-    SELECT well FROM WellFieldStock ORDER BY well
+    SELECT well
+    FROM tool_stock
+    WHERE well != ''
+    GROUP BY well
+    HAVING SUM(field_stock) > 0
+    ORDER BY well
     """
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df['well'].tolist()
 
+    return fetch_column(query)
+
+@st.cache_data(ttl=60)
 def get_all_sales_orders():
     """Gets a list of all unique, non-empty sales orders."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT sales_order FROM inventory_movements WHERE sales_order IS NOT NULL AND sales_order != '' ORDER BY sales_order")
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return fetch_column("SELECT DISTINCT sales_order FROM inventory_movements WHERE sales_order IS NOT NULL AND sales_order != '' ORDER BY sales_order")
 
+@st.cache_data(ttl=60)
 def get_all_wells():
     """Gets a list of all unique, non-empty well names."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute("SELECT DISTINCT well FROM inventory_movements WHERE well IS NOT NULL AND well != '' ORDER BY well")
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    return fetch_column("SELECT DISTINCT well FROM inventory_movements WHERE well IS NOT NULL AND well != '' ORDER BY well")
+
+def display_paginated(df, key, page_size=50):
+    """Shows a dataframe one page at a time so long lists are not sent to the browser on every rerun."""
+    n_pages = max(1, -(-len(df) // page_size))
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, value=1, step=1, key=key)
+    st.dataframe(df.iloc[(page - 1) * page_size:page * page_size], use_container_width=True)
+
+@st.cache_data(ttl=300)
+def wells_map_html(wells_for_map_df):
+    """Renders the wells map to HTML; cached on the wells data so reruns skip rebuilding it."""
+    import html
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+    # Calculate center of the map
+    center_lat = wells_for_map_df['latitude'].mean()
+    center_lon = wells_for_map_df['longitude'].mean()
+
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
+
+    # Hovering shows just the well name; the details are built column-wise into a popup that Leaflet only
+    # lays out when a marker is clicked. Optional fields only appear when set. Free-text fields are escaped
+    # because the page is embedded as raw HTML
+    names = wells_for_map_df['name'].astype(str).map(html.escape)
+    trajectory = wells_for_map_df['well_trajectory'].fillna('').astype(str).map(html.escape)
+    fluid = wells_for_map_df['well_fluid'].fillna('').astype(str).map(html.escape)
+    popups = (
+        "<b>Name:</b> " + names + "<br>"
+        + "<b>Latitude:</b> " + wells_for_map_df['latitude'].astype(str) + "<br>"
+        + "<b>Longitude:</b> " + wells_for_map_df['longitude'].astype(str) + "<br>"
+        + ("<b>Trajectory:</b> " + trajectory + "<br>").where(trajectory != '', '')
+        + ("<b>Fluid:</b> " + fluid + "<br>").where(fluid != '', '')
+    )
+    # Markers are created in the browser from [lat, lon, name, popup] rows instead of one folium.Marker each
+    FastMarkerCluster(
+        list(zip(wells_for_map_df['latitude'], wells_for_map_df['longitude'], names, popups)),
+        callback="function (row) { return L.marker(new L.LatLng(row[0], row[1])).bindTooltip(row[2]).bindPopup(row[3], {maxWidth: 300}); }"
+    ).add_to(m)
+    return m.get_root().render()
 
 # ==============================================================================
 # Módulo: INTERFAZ DE USUARIO DE STREAMLIT
@@ -1337,334 +1367,344 @@ if main_menu == "IN":
     if in_type == "Importation":
         st.subheader("New Importation")
         if input_mode == "Single Entry":
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                sales_order = st.text_input("Sales Order #", key="in_single_so_input")
-            with col2:
-                responsible = st.selectbox("Responsible", options=get_responsibles(), key="in_single_resp_select")
-            with col3:
-                date = st.date_input("Date", value=datetime.today(), key="in_single_date_input")
+            @st.fragment
+            def importation_single_entry():
+                """Single-entry importation: header fields, tool form and the list to save."""
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    sales_order = st.text_input("Sales Order #", key="in_single_so_input")
+                with col2:
+                    responsible = st.selectbox("Responsible", options=get_responsibles(), key="in_single_resp_select")
+                with col3:
+                    date = st.date_input("Date", value=datetime.today(), key="in_single_date_input")
             
-            st.markdown("---")
+                st.markdown("---")
 
-            col_form, col_list = st.columns([2, 3])
+                col_form, col_list = st.columns([2, 3])
 
-            with col_form:
-                st.subheader("Add Tool")
-                tool_type = st.radio("Tool Type", ["Unique_Tools", "Miscelaneous"], key="in_single_tool_type_selector", horizontal=True)
+                with col_form:
+                    st.subheader("Add Tool")
+                    tool_type = st.radio("Tool Type", ["Unique_Tools", "Miscelaneous"], key="in_single_tool_type_selector", horizontal=True)
 
-                application = "N/A"
-                tool_type_options = []
+                    application = "N/A"
+                    tool_type_options = []
 
-                if tool_type == "Unique_Tools":
-                    application = st.selectbox("Tool Application", options=[""] + UNIQUE_TOOL_APPLICATION_OPTIONS, key="in_single_app_unique", index=0)
-                    tool_type_options = get_tool_types_by_application(application)
+                    if tool_type == "Unique_Tools":
+                        application = st.selectbox("Tool Application", options=UNIQUE_TOOL_APPLICATION_OPTIONS_WITH_BLANK, key="in_single_app_unique", index=0)
+                        tool_type_options = get_tool_types_by_application(application)
                 
-                if tool_type == "Unique_Tools":
-                    st.markdown("**Unique Tool**")
+                    if tool_type == "Unique_Tools":
+                        st.markdown("**Unique Tool**")
                 
-                specific_type = st.selectbox("Tool Type", options=[""] + tool_type_options, key="in_single_spec_type_unique", index=0)
+                    specific_type = st.selectbox("Tool Type", options=[""] + tool_type_options, key="in_single_spec_type_unique", index=0)
+
+                    seat_size = None
+                    # Conditionally show seat_size input for specific sleeve types
+                    if specific_type in SEAT_SIZE_TYPES:
+                        seat_size = st.text_input("Seat Size", key="in_single_seat_size_unique")
+
+                    receptacle_size = None
+                    if specific_type == 'Landing Sub':
+                        receptacle_size = st.text_input("Receptacle Size", key="in_single_receptacle_size_unique")
+
+                    with st.form("add_tool_form", clear_on_submit=True):
+                        if tool_type == "Unique_Tools":
+                            part_number = st.text_input("Part Number", key="in_single_pn_unique")
+                            serial_number = st.text_input("Serial Number", key="in_single_sn_unique")
+                            description = st.text_input("Description", key="in_single_desc_unique")
+                            quantity = 1
+                        else: # Miscelaneous
+                            st.markdown("**Miscellaneous Tool**")
+                            # Ensure application is set to Miscellaneous for this type
+                            application = "Miscellaneous" 
+                            specific_type = st.selectbox("Tool Type", options=[""] + get_tool_types_by_application("Miscellaneous"), key="in_single_spec_type_misc", index=0)
+                            part_number = st.text_input("Part Number", key="in_single_pn_misc")
+                            description = st.text_input("Description", key="in_single_desc_misc")
+                            quantity = st.number_input("Quantity", min_value=1, step=1, key="in_single_qty_misc")
+                            serial_number = None
+
+                        add_tool_button = st.form_submit_button("Add Tool to List")
+
+                        if add_tool_button:
+                            if 'tools_to_add' not in st.session_state:
+                                st.session_state.tools_to_add = []
+
+                            if not part_number:
+                                st.warning("Part Number is mandatory.")
+                            elif tool_type == 'Unique_Tools' and not specific_type:
+                                st.warning("For Unique Tools, Tool Type is mandatory.")
+                            elif tool_type == 'Miscelaneous' and not description:
+                                st.warning("For Miscellaneous Tools, Description is mandatory.")
+                            else:
+                                new_tool = {
+                                    'part_number': part_number, 'serial_number': serial_number, 'quantity': quantity,
+                                    'tool_type': tool_type, 'application': application, 'specific_type': specific_type,
+                                    'description': description, 'seat_size': seat_size, 'receptacle_size': receptacle_size
+                                }
+                                st.session_state.tools_to_add.append(new_tool)
+
+                with col_list:
+                    st.subheader("Tools to Import")
+                    if st.session_state.get('tools_to_add'):
+                        display_df = pd.DataFrame(st.session_state.tools_to_add)
+                        display_paginated(display_df, key="in_single_preview_page")
+                    
+                        col_final_1, col_final_2 = st.columns(2)
+                        with col_final_1:
+                            if st.button("✅ Save Full Importation", key="in_single_save_import_button"):
+                                error_messages = []
+                                if not sales_order:
+                                    error_messages.append("Sales Order is mandatory.")
+                                if not responsible:
+                                    error_messages.append("Responsible is mandatory.")
+                            
+                                if error_messages:
+                                    st.error("❌ " + " ".join(error_messages))
+                                else:
+                                    try:
+                                        add_importation(sales_order, responsible, date.strftime('%Y-%m-%d'), st.session_state.tools_to_add)
+                                        st.success(f"✅ Importation with Sales Order '{sales_order}' saved successfully.")
+                                        st.session_state.tools_to_add = []
+                                        st.rerun()
+                                    except ValueError as e:
+                                        st.error(f"❌ Validation Error: {e}")
+                                    except Exception as e:
+                                        st.error(f"❌ An unexpected error occurred: {e}")
+                        with col_final_2:
+                            if st.button("🗑️ Clear Tool List", key="in_single_clear_list_button"):
+                                st.session_state.tools_to_add = []
+                                st.rerun()
+                    else:
+                        st.info("The list of tools to import will appear here.")
+
+            importation_single_entry()
 
-                seat_size = None
-                # Conditionally show seat_size input for specific sleeve types
-                if specific_type in ['Open Hole Multi-Entry Sleeve', 'Open Single-Entry Sleeve', 'Cemented Multi-Entry Sleeve', 'Cemented Single-Entry Sleeve', 'Open Hole Single-Entry Sleeve']:
-                    seat_size = st.text_input("Seat Size", key="in_single_seat_size_unique")
+        elif input_mode == "Batch Mode":
+            @st.fragment
+            def importation_batch():
+                """Batch importation from an uploaded Excel file."""
+                st.subheader("Batch Import from Excel")
+                st.markdown("Ensure your Excel file has the following columns: `tool_type`, `part_number`, `serial_number`, `quantity`, `application`, `specific_type`, `description`.")
+            
+                col1, col2, col3 = st.columns(3)
+                with col1:
+                    sales_order_batch = st.text_input("Sales Order #", key="in_batch_so_input")
+                with col2:
+                    responsible_batch = st.selectbox("Responsible", options=get_responsibles(), key="in_batch_resp_select")
+                with col3:
+                    date_batch = st.date_input("Date", value=datetime.today(), key="in_batch_date_input")
 
-                receptacle_size = None
-                if specific_type == 'Landing Sub':
-                    receptacle_size = st.text_input("Receptacle Size", key="in_single_receptacle_size_unique")
+                uploaded_file = st.file_uploader("Upload your Excel file", type=["xlsx"], key="in_batch_uploader")
 
-                with st.form("add_tool_form", clear_on_submit=True):
-                    if tool_type == "Unique_Tools":
-                        part_number = st.text_input("Part Number", key="in_single_pn_unique")
-                        serial_number = st.text_input("Serial Number", key="in_single_sn_unique")
-                        description = st.text_input("Description", key="in_single_desc_unique")
-                        quantity = 1
-                    else: # Miscelaneous
-                        st.markdown("**Miscellaneous Tool**")
-                        # Ensure application is set to Miscellaneous for this type
-                        application = "Miscellaneous" 
-                        specific_type = st.selectbox("Tool Type", options=[""] + get_tool_types_by_application("Miscellaneous"), key="in_single_spec_type_misc", index=0)
-                        part_number = st.text_input("Part Number", key="in_single_pn_misc")
-                        description = st.text_input("Description", key="in_single_desc_misc")
-                        quantity = st.number_input("Quantity", min_value=1, step=1, key="in_single_qty_misc")
-                        serial_number = None
-
-                    add_tool_button = st.form_submit_button("Add Tool to List")
-
-                    if add_tool_button:
-                        if 'tools_to_add' not in st.session_state:
-                            st.session_state.tools_to_add = []
-
-                        is_valid = True
-                        if not part_number:
-                            st.warning("Part Number is mandatory.")
-                            is_valid = False
-                        if tool_type == 'Unique_Tools' and not specific_type:
-                            st.warning("For Unique Tools, Tool Type is mandatory.")
-                            is_valid = False
-                        if tool_type == 'Miscelaneous' and not description:
-                            st.warning("For Miscellaneous Tools, Description is mandatory.")
-                            is_valid = False
-
-                        if is_valid:
-                            new_tool = {
-                                'part_number': part_number, 'serial_number': serial_number, 'quantity': quantity,
-                                'tool_type': tool_type, 'application': application, 'specific_type': specific_type,
-                                'description': description, 'seat_size': seat_size, 'receptacle_size': receptacle_size
-                            }
-                            st.session_state.tools_to_add.append(new_tool)
+                if uploaded_file:
+                    try:
+                        df = parse_batch_excel(uploaded_file.getvalue())
+                        st.markdown("**Data Preview:**")
+                        st.dataframe(df.head(200))
+                        if len(df) > 200:
+                            st.caption(f"Showing first 200 of {len(df)} rows.")
+
+                        if st.button("Validate and Prepare Import", key="in_batch_validate_button"):
+                            st.session_state.batch_to_add = df # Kept as a DataFrame; records are only built when saving
+                            st.success("File validated and ready for import.")
                             st.rerun()
 
-            with col_list:
-                st.subheader("Tools to Import")
-                if st.session_state.get('tools_to_add'):
-                    display_df = pd.DataFrame(st.session_state.tools_to_add)
-                    st.dataframe(display_df, use_container_width=True)
-                    
+                    except Exception as e:
+                        st.error(f"Error reading file: {e}")
+
+                if st.session_state.get('batch_to_add') is not None and not st.session_state.batch_to_add.empty:
+                    st.markdown("### Validated Tools to Import")
+                    display_paginated(st.session_state.batch_to_add, key="in_batch_preview_page")
+                
                     col_final_1, col_final_2 = st.columns(2)
                     with col_final_1:
-                        if st.button("✅ Save Full Importation", key="in_single_save_import_button"):
-                            error_messages = []
-                            if not sales_order:
-                                error_messages.append("Sales Order is mandatory.")
-                            if not responsible:
-                                error_messages.append("Responsible is mandatory.")
-                            
-                            if error_messages:
-                                st.error("❌ " + " ".join(error_messages))
+                        if st.button("✅ Save Batch Import", key="in_batch_save_import_button"):
+                            if not sales_order_batch or not responsible_batch:
+                                st.error("❌ Sales Order and Responsible are mandatory for batch import.")
                             else:
                                 try:
-                                    add_importation(sales_order, responsible, date.strftime('%Y-%m-%d'), st.session_state.tools_to_add)
-                                    st.success(f"✅ Importation with Sales Order '{sales_order}' saved successfully.")
-                                    st.session_state.tools_to_add = []
+                                    add_importation(sales_order_batch, responsible_batch, date_batch.strftime('%Y-%m-%d'), st.session_state.batch_to_add.to_dict('records'))
+                                    st.success("✅ Batch Import saved successfully.")
+                                    st.session_state.batch_to_add = None
                                     st.rerun()
                                 except ValueError as e:
                                     st.error(f"❌ Validation Error: {e}")
                                 except Exception as e:
-                                    st.error(f"❌ An unexpected error occurred: {e}")
+                                    st.error(f"❌ An unexpected error occurred during batch import: {e}")
                     with col_final_2:
-                        if st.button("🗑️ Clear Tool List", key="in_single_clear_list_button"):
-                            st.session_state.tools_to_add = []
+                        if st.button("🗑️ Cancel Batch", key="in_batch_cancel_button"):
+                            st.session_state.batch_to_add = None
                             st.rerun()
-                else:
-                    st.info("The list of tools to import will appear here.")
 
-        elif input_mode == "Batch Mode":
-            st.subheader("Batch Import from Excel")
-            st.markdown("Ensure your Excel file has the following columns: `tool_type`, `part_number`, `serial_number`, `quantity`, `application`, `specific_type`, `description`.")
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                sales_order_batch = st.text_input("Sales Order #", key="in_batch_so_input")
-            with col2:
-                responsible_batch = st.selectbox("Responsible", options=get_responsibles(), key="in_batch_resp_select")
-            with col3:
-                date_batch = st.date_input("Date", value=datetime.today(), key="in_batch_date_input")
-
-            uploaded_file = st.file_uploader("Upload your Excel file", type=["xlsx"], key="in_batch_uploader")
-
-            if uploaded_file:
-                try:
-                    df = pd.read_excel(uploaded_file, dtype=str).fillna('')
-                    st.markdown("**Data Preview:**")
-                    st.dataframe(df)
-
-                    if st.button("Validate and Prepare Import", key="in_batch_validate_button"):
-                        valid_tools = df.to_dict('records')
-                        st.session_state.batch_to_add = valid_tools
-                        st.success("File validated and ready for import.")
-                        st.rerun()
-
-                except Exception as e:
-                    st.error(f"Error reading file: {e}")
-
-            if 'batch_to_add' in st.session_state and st.session_state.batch_to_add:
-                st.markdown("### Validated Tools to Import")
-                st.dataframe(pd.DataFrame(st.session_state.batch_to_add))
-                
-                col_final_1, col_final_2 = st.columns(2)
-                with col_final_1:
-                    if st.button("✅ Save Batch Import", key="in_batch_save_import_button"):
-                        if not sales_order_batch or not responsible_batch:
-                            st.error("❌ Sales Order and Responsible are mandatory for batch import.")
-                        else:
-                            try:
-                                add_importation(sales_order_batch, responsible_batch, date_batch.strftime('%Y-%m-%d'), st.session_state.batch_to_add)
-                                st.success("✅ Batch Import saved successfully.")
-                                st.session_state.batch_to_add = []
-                                st.rerun()
-                            except ValueError as e:
-                                st.error(f"❌ Validation Error: {e}")
-                            except Exception as e:
-                                st.error(f"❌ An unexpected error occurred during batch import: {e}")
-                with col_final_2:
-                    if st.button("🗑️ Cancel Batch", key="in_batch_cancel_button"):
-                        st.session_state.batch_to_add = []
-                        st.rerun()
+            importation_batch()
 
     elif in_type == "Return":
         st.subheader("Register Return from Field")
         if input_mode == "Single Entry":
-            responsible_return = st.selectbox("Responsible", options=get_responsibles(), key="in_return_resp_select")
-            date_return = st.date_input("Return Date", value=datetime.today(), key="in_return_date_input")
-
-            # Filter 1: Tool Category (Unique Tool or Miscellaneous)
-            selected_category_return = st.selectbox(
-                "1) Select Tool Category",
-                options=["", "Unique_Tools", "Miscelaneous"],
-                key="in_return_category_filter"
-            )
-
-            effective_application_return = None
-            selected_application_return = None # Initialize to None
+            @st.fragment
+            def return_single_entry():
+                """Return picker, return preview and backload note generation."""
+                responsible_return = st.selectbox("Responsible", options=get_responsibles(), key="in_return_resp_select")
+                date_return = st.date_input("Return Date", value=datetime.today(), key="in_return_date_input")
+
+                # Filter 1: Tool Category (Unique Tool or Miscellaneous)
+                selected_category_return = st.selectbox(
+                    "1) Select Tool Category",
+                    options=["", "Unique_Tools", "Miscelaneous"],
+                    key="in_return_category_filter"
+                )
 
-            if selected_category_return == "Unique_Tools":
-                # Display Filter 2: Tool Application for Unique Tools
-                all_applications_return = UNIQUE_TOOL_APPLICATION_OPTIONS
-                selected_application_return = st.selectbox(
-                    "2) Select Application",
-                    options=[""] + all_applications_return,
-                    key="in_return_application_filter"
+                effective_application_return = None
+                selected_application_return = None # Initialize to None
+
+                if selected_category_return == "Unique_Tools":
+                    # Display Filter 2: Tool Application for Unique Tools
+                    selected_application_return = st.selectbox(
+                        "2) Select Application",
+                        options=UNIQUE_TOOL_APPLICATION_OPTIONS_WITH_BLANK,
+                        key="in_return_application_filter"
+                    )
+                    effective_application_return = selected_application_return
+                elif selected_category_return == "Miscelaneous":
+                    # For Miscellaneous, application is implicitly "Miscellaneous"
+                    effective_application_return = "Miscellaneous"
+                    st.markdown("*(Application: Miscellaneous)*") # Indicate that application is fixed
+
+                # Filter 3: Tool Type (dynamically populated based on effective_application)
+                all_specific_types_return = []
+                if effective_application_return: # Only fetch specific types if an application is determined
+                    all_specific_types_return = get_tool_types_by_application(effective_application_return)
+
+                selected_specific_type_return = st.selectbox(
+                    "3) Select Specific Tool Type",
+                    options=[""] + all_specific_types_return,
+                    key="in_return_specific_type_filter"
                 )
-                effective_application_return = selected_application_return
-            elif selected_category_return == "Miscelaneous":
-                # For Miscellaneous, application is implicitly "Miscellaneous"
-                effective_application_return = "Miscellaneous"
-                st.markdown("*(Application: Miscellaneous)*") # Indicate that application is fixed
-
-            # Filter 3: Tool Type (dynamically populated based on effective_application)
-            all_specific_types_return = []
-            if effective_application_return: # Only fetch specific types if an application is determined
-                all_specific_types_return = get_tool_types_by_application(effective_application_return)
-
-            selected_specific_type_return = st.selectbox(
-                "3) Select Specific Tool Type",
-                options=[""] + all_specific_types_return,
-                key="in_return_specific_type_filter"
-            )
 
-            # New: Filter by Well
-            all_wells_in_field = get_wells_in_field()
-            selected_well_return = st.selectbox(
-                "4) Select Well (where tool was dispatched)",
-                options=[""] + all_wells_in_field,
-                key="in_return_well_filter"
-            )
+                # New: Filter by Well
+                all_wells_in_field = get_wells_in_field()
+                selected_well_return = st.selectbox(
+                    "4) Select Well (where tool was dispatched)",
+                    options=[""] + all_wells_in_field,
+                    key="in_return_well_filter"
+                )
 
-            tools_in_field = get_tools_in_location(
-                'Field',
-                tool_category=selected_category_return if selected_category_return else None,
-                tool_application=effective_application_return if effective_application_return else None,
-                tool_specific_type=selected_specific_type_return if selected_specific_type_return else None,
-                well=selected_well_return if selected_well_return else None
-            )
+                tools_in_field = get_tools_in_location(
+                    'Field',
+                    tool_category=selected_category_return if selected_category_return else None,
+                    tool_application=effective_application_return if effective_application_return else None,
+                    tool_specific_type=selected_specific_type_return if selected_specific_type_return else None,
+                    well=selected_well_return if selected_well_return else None
+                )
 
-            if not tools_in_field:
-                st.warning("No tools in field to return matching selected filters.")
-            else:
-                tool_options = {tool['display_name']: tool for tool in tools_in_field}
-                selected_tool_display_name = st.selectbox("Select a tool to return", options=[""] + list(tool_options.keys()), index=0, key="in_return_tool_select")
-                selected_tool_data = tool_options.get(selected_tool_display_name)
-                if selected_tool_data:
-                    quantity_to_return = 1
-                    if selected_tool_data['type'] == 'Miscelaneous':
-                        quantity_to_return = st.number_input("Quantity to return", min_value=1, max_value=selected_tool_data['quantity'], value=1, step=1, key="in_return_qty_input")
+                if not tools_in_field:
+                    st.warning("No tools in field to return matching selected filters.")
+                else:
+                    tool_options = {tool['display_name']: tool for tool in tools_in_field}
+                    selected_tool_display_name = st.selectbox("Select a tool to return", options=[""] + list(tool_options.keys()), index=0, key="in_return_tool_select")
+                    selected_tool_data = tool_options.get(selected_tool_display_name)
+                    if selected_tool_data:
+                        quantity_to_return = 1
+                        if selected_tool_data['type'] == 'Miscelaneous':
+                            quantity_to_return = st.number_input("Quantity to return", min_value=1, max_value=selected_tool_data['quantity'], value=1, step=1, key="in_return_qty_input")
                     
-                    # New button to add to preview list
-                    if st.button("Add to Return List", key="in_return_add_to_list_button"):
-                        if 'backload_tools_preview' not in st.session_state:
-                            st.session_state.backload_tools_preview = []
+                        # New button to add to preview list
+                        if st.button("Add to Return List", key="in_return_add_to_list_button"):
+                            if 'backload_tools_preview' not in st.session_state:
+                                st.session_state.backload_tools_preview = []
                         
-                        # Add relevant data to the preview list
-                        st.session_state.backload_tools_preview.append({
-                            'id': selected_tool_data['id'],
-                            'part_number': selected_tool_data['part_number'],
-                            'serial_number': selected_tool_data.get('serial_number'),
-                            'description': selected_tool_data.get('description', ''),
-                            'quantity': quantity_to_return,
-                            'display_name': selected_tool_data['display_name'],
-                            'well': selected_tool_data.get('well') # Add well here
-                        })
-                        st.success(f"Tool {selected_tool_display_name} added to return list.")
-                        st.rerun()
+                            # Add relevant data to the preview list
+                            st.session_state.backload_tools_preview.append({
+                                'id': selected_tool_data['id'],
+                                'part_number': selected_tool_data['part_number'],
+                                'serial_number': selected_tool_data.get('serial_number'),
+                                'description': selected_tool_data.get('description', ''),
+                                'quantity': quantity_to_return,
+                                'display_name': selected_tool_data['display_name'],
+                                'well': selected_tool_data.get('well') # Add well here
+                            })
+                            st.success(f"Tool {selected_tool_display_name} added to return list.")
+                            st.rerun()
 
-            # Display preview and PDF generation fields if there are items in the preview list
-            if st.session_state.get('backload_tools_preview'):
-                st.markdown("---")
-                st.subheader("Tools to Return (Preview)")
-                preview_df = pd.DataFrame(st.session_state.backload_tools_preview)
-                st.dataframe(preview_df[['display_name', 'quantity']], use_container_width=True)
-
-                col_preview_confirm, col_preview_clear = st.columns(2)
-                with col_preview_confirm:
-                    if st.button("✅ Confirm Return List", key="in_return_confirm_list_button"):
-                        # Store the final list for PDF generation and database update
-                        st.session_state.final_backload_list = st.session_state.backload_tools_preview
-                        st.session_state.backload_responsible = responsible_return
-                        st.session_state.backload_date = date_return.strftime('%Y-%m-%d')
-                        st.success("Return list confirmed. Proceed to Backload Note Generation.")
-                        st.session_state.backload_tools_preview = [] # Clear preview list
-                        st.rerun()
-                with col_preview_clear:
-                    if st.button("🗑️ Clear Return List", key="in_return_clear_list_button"):
-                        st.session_state.backload_tools_preview = []
-                        st.info("Return list cleared.")
-                        st.rerun()
+                # Display preview and PDF generation fields if there are items in the preview list
+                if st.session_state.get('backload_tools_preview'):
+                    st.markdown("---")
+                    st.subheader("Tools to Return (Preview)")
+                    preview_df = pd.DataFrame(st.session_state.backload_tools_preview)
+                    display_paginated(preview_df[['display_name', 'quantity']], key="in_return_preview_page")
+
+                    col_preview_confirm, col_preview_clear = st.columns(2)
+                    with col_preview_confirm:
+                        if st.button("✅ Confirm Return List", key="in_return_confirm_list_button"):
+                            # Store the final list for PDF generation and database update
+                            st.session_state.final_backload_list = st.session_state.backload_tools_preview
+                            st.session_state.backload_responsible = responsible_return
+                            st.session_state.backload_date = date_return.strftime('%Y-%m-%d')
+                            st.success("Return list confirmed. Proceed to Backload Note Generation.")
+                            st.session_state.backload_tools_preview = [] # Clear preview list
+                            st.rerun()
+                    with col_preview_clear:
+                        if st.button("🗑️ Clear Return List", key="in_return_clear_list_button"):
+                            st.session_state.backload_tools_preview = []
+                            st.info("Return list cleared.")
+                            st.rerun()
 
-            # Backload Note Generation section (shown after return list is confirmed)
-            if 'pdf_output_for_download_backload' in st.session_state and st.session_state.pdf_output_for_download_backload:
-                st.success("✅ Backload Note generated and return registered successfully! Click below to download.")
+                # Backload Note Generation section (shown after return list is confirmed)
+                if 'pdf_output_for_download_backload' in st.session_state and st.session_state.pdf_output_for_download_backload:
+                    st.success("✅ Backload Note generated and return registered successfully! Click below to download.")
                 
-                st.download_button(
-                    label="Download Backload Note",
-                    data=st.session_state.pdf_output_for_download_backload,
-                    file_name=st.session_state.generated_backload_note_filename,
-                    mime="application/pdf"
-                )
-
-                if st.button("Start New Return"):
-                    # Clear all related session state to reset the form
-                    keys_to_clear = [
-                        'pdf_output_for_download_backload', 'generated_backload_note_filename',
-                        'final_backload_list', 'backload_responsible', 'backload_date'
-                    ]
-                    for key in keys_to_clear:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    st.rerun()
+                    st.download_button(
+                        label="Download Backload Note",
+                        data=st.session_state.pdf_output_for_download_backload,
+                        file_name=st.session_state.generated_backload_note_filename,
+                        mime="application/pdf"
+                    )
+
+                    if st.button("Start New Return"):
+                        # Clear all related session state to reset the form
+                        keys_to_clear = [
+                            'pdf_output_for_download_backload', 'generated_backload_note_filename',
+                            'final_backload_list', 'backload_responsible', 'backload_date'
+                        ]
+                        for key in keys_to_clear:
+                            if key in st.session_state:
+                                del st.session_state[key]
+                        st.rerun()
 
-            elif st.session_state.get('final_backload_list'):
-                st.markdown("---")
-                st.subheader("Backload Note Generation")
-                st.write("**Confirmed Return Details:**")
-                st.dataframe(pd.DataFrame(st.session_state.final_backload_list)[['display_name', 'quantity']], use_container_width=True)
-
-                backload_doc_number = st.text_input("Document Number", key="in_return_backload_doc_number_final")
-
-                if st.button("Generate and Download Backload Note", key="in_return_generate_backload_button"):
-                    if backload_doc_number:
-                        # Call return_tools_batch here, as the return is now finalized with BN details
-                        return_tools_batch(
-                            st.session_state.final_backload_list,
-                            st.session_state.backload_responsible,
-                            st.session_state.backload_date
-                        )
-
-                        pdf_output = generate_backload_note_pdf(
-                            backload_doc_number,
-                            st.session_state.backload_responsible,
-                            st.session_state.backload_date,
-                            st.session_state.final_backload_list
-                        )
-                        file_name = f"{st.session_state.backload_date}_Client_N_A_Backload_Note.pdf"
-
-                        st.session_state.pdf_output_for_download_backload = pdf_output
-                        st.session_state.generated_backload_note_filename = file_name
+                elif st.session_state.get('final_backload_list'):
+                    st.markdown("---")
+                    st.subheader("Backload Note Generation")
+                    st.write("**Confirmed Return Details:**")
+                    display_paginated(pd.DataFrame(st.session_state.final_backload_list)[['display_name', 'quantity']], key="in_return_final_page")
+
+                    backload_doc_number = st.text_input("Document Number", key="in_return_backload_doc_number_final")
+
+                    if st.button("Generate and Download Backload Note", key="in_return_generate_backload_button"):
+                        if backload_doc_number:
+                            # Call return_tools_batch here, as the return is now finalized with BN details
+                            return_tools_batch(
+                                st.session_state.final_backload_list,
+                                st.session_state.backload_responsible,
+                                st.session_state.backload_date
+                            )
+
+                            with st.spinner("Generating backload note..."):
+                                pdf_output = generate_backload_note_pdf(
+                                    backload_doc_number,
+                                    st.session_state.backload_responsible,
+                                    st.session_state.backload_date,
+                                    st.session_state.final_backload_list
+                                )
+                            file_name = f"{st.session_state.backload_date}_Client_N_A_Backload_Note.pdf"
+
+                            st.session_state.pdf_output_for_download_backload = pdf_output
+                            st.session_state.generated_backload_note_filename = file_name
                         
-                        st.rerun()
-                    else:
-                        st.warning("Please enter a Document Number for the Backload Note.")
+                            st.rerun()
+                        else:
+                            st.warning("Please enter a Document Number for the Backload Note.")
+
+            return_single_entry()
 
 
         
@@ -1689,137 +1729,128 @@ elif main_menu == "OUT":
     if 'dispatch_list' not in st.session_state:
         st.session_state.dispatch_list = []
 
-    # --- Logic to calculate available tools based on what's already in the dispatch list ---
-    stock_list = get_tools_in_location('Warehouse')
-    dispatch_misc_quantities = {}
-    for item in st.session_state.dispatch_list:
-        if item['type'] == 'Miscelaneous':
-            dispatch_misc_quantities[item['id']] = dispatch_misc_quantities.get(item['id'], 0) + item['quantity_to_dispatch']
-
-    available_tools = []
-    for tool in stock_list:
-        if tool['type'] == 'Unique_Tools':
-            if not any(d['id'] == tool['id'] for d in st.session_state.dispatch_list):
-                available_tools.append(tool)
-        elif tool['type'] == 'Miscelaneous':
-            dispatched_qty = dispatch_misc_quantities.get(tool['id'], 0)
-            remaining_stock = tool['quantity'] - dispatched_qty
-            if remaining_stock > 0:
-                adjusted_tool = tool.copy()
-                adjusted_tool['quantity'] = remaining_stock
-                # Adjust display name to show remaining stock
-                base_name = tool['display_name'].split(' - Stock:')[0]
-                adjusted_tool['display_name'] = f"{base_name} - Stock: {remaining_stock}"
-                available_tools.append(adjusted_tool)
-
-    # --- UI for adding tools (formless) ---
-    st.subheader("Add Tool to Dispatch")
-
-    # Filter 1: Tool Category (Unique Tool or Miscellaneous)
-    selected_category = st.selectbox(
-        "1) Select Tool Category",
-        options=["", "Unique_Tools", "Miscelaneous"],
-        key="out_dispatch_category_filter"
-    )
+    @st.fragment
+    def dispatch_tool_picker():
+        """Filters and tool selector for the dispatch list; widget changes here rerun only this fragment."""
+        # --- UI for adding tools (formless) ---
+        st.subheader("Add Tool to Dispatch")
+
+        # Filter 1: Tool Category (Unique Tool or Miscellaneous)
+        selected_category = st.selectbox(
+            "1) Select Tool Category",
+            options=["", "Unique_Tools", "Miscelaneous"],
+            key="out_dispatch_category_filter"
+        )
 
-    effective_application = None
-    selected_application = None # Initialize to None
+        effective_application = None
+        selected_application = None # Initialize to None
 
-    if selected_category == "Unique_Tools":
-        # Display Filter 2: Tool Application for Unique Tools
-        all_applications = UNIQUE_TOOL_APPLICATION_OPTIONS
-        selected_application = st.selectbox(
-            "2) Select Application",
-            options=[""] + all_applications,
-            key="out_dispatch_application_filter"
+        if selected_category == "Unique_Tools":
+            # Display Filter 2: Tool Application for Unique Tools
+            selected_application = st.selectbox(
+                "2) Select Application",
+                options=UNIQUE_TOOL_APPLICATION_OPTIONS_WITH_BLANK,
+                key="out_dispatch_application_filter"
+            )
+            effective_application = selected_application
+        elif selected_category == "Miscelaneous":
+            # For Miscellaneous, application is implicitly "Miscellaneous"
+            effective_application = "Miscellaneous"
+
+        # Filter 3: Tool Type (dynamically populated based on effective_application)
+        all_specific_types = []
+        if effective_application: # Only fetch specific types if an application is determined
+            all_specific_types = get_tool_types_by_application(effective_application)
+
+        selected_specific_type = st.selectbox(
+            "3) Select Specific Tool Type",
+            options=[""] + all_specific_types,
+            key="out_dispatch_specific_type_filter"
         )
-        effective_application = selected_application
-    elif selected_category == "Miscelaneous":
-        # For Miscellaneous, application is implicitly "Miscellaneous"
-        effective_application = "Miscellaneous"
-
-    # Filter 3: Tool Type (dynamically populated based on effective_application)
-    all_specific_types = []
-    if effective_application: # Only fetch specific types if an application is determined
-        all_specific_types = get_tool_types_by_application(effective_application)
-
-    selected_specific_type = st.selectbox(
-        "3) Select Specific Tool Type",
-        options=[""] + all_specific_types,
-        key="out_dispatch_specific_type_filter"
-    )
 
-    # Get available tools based on selected filters
-    stock_list = get_tools_in_location(
-        'Warehouse',
-        tool_category=selected_category if selected_category else None,
-        tool_application=effective_application if effective_application else None, # Use effective_application here
-        tool_specific_type=selected_specific_type if selected_specific_type else None
-    )
+        # Get available tools based on selected filters
+        stock_list = get_tools_in_location(
+            'Warehouse',
+            tool_category=selected_category if selected_category else None,
+            tool_application=effective_application if effective_application else None, # Use effective_application here
+            tool_specific_type=selected_specific_type if selected_specific_type else None
+        )
 
-    dispatch_misc_quantities = {}
-    for item in st.session_state.dispatch_list:
-        if item['type'] == 'Miscelaneous':
-            dispatch_misc_quantities[item['id']] = dispatch_misc_quantities.get(item['id'], 0) + item['quantity_to_dispatch']
-
-    available_tools = []
-    for tool in stock_list:
-        if tool['type'] == 'Unique_Tools':
-            if not any(d['id'] == tool['id'] for d in st.session_state.dispatch_list):
-                available_tools.append(tool)
-        elif tool['type'] == 'Miscelaneous':
-            dispatched_qty = dispatch_misc_quantities.get(tool['id'], 0)
-            remaining_stock = tool['quantity'] - dispatched_qty
-            if remaining_stock > 0:
-                adjusted_tool = tool.copy()
-                adjusted_tool['quantity'] = remaining_stock
-                # Adjust display name to show remaining stock
-                base_name = tool['display_name'].split(' - Stock:')[0]
-                adjusted_tool['display_name'] = f"{base_name} - Stock: {remaining_stock}"
-                available_tools.append(adjusted_tool)
-
-    if not available_tools:
-        st.warning("No tools available in warehouse matching selected filters.")
-    else:
-        col_select, col_qty = st.columns([4, 1]) # Adjusted columns
-        with col_select:
-            tool_options = {tool['display_name']: tool for tool in available_tools}
-            selected_tool_display_name = st.selectbox("Select a tool", options=[""] + list(tool_options.keys()), key="out_dispatch_tool_selector", index=0)
-            selected_tool_data = tool_options.get(selected_tool_display_name)
-
-        quantity_to_dispatch = 1
-        if selected_tool_data:
-            if selected_tool_data['type'] == 'Miscelaneous':
-                with col_qty:
-                    max_qty = selected_tool_data['quantity'] # This is the remaining stock
-                    quantity_to_dispatch = st.number_input("Quantity", min_value=1, max_value=max_qty, value=1, step=1, key="out_dispatch_qty_input")
+        # --- Logic to calculate available tools based on what's already in the dispatch list ---
+        dispatch_ids = set() # Lookup set instead of scanning the dispatch list for every tool
+        dispatch_misc_quantities = {}
+        for item in st.session_state.dispatch_list:
+            dispatch_ids.add(item['id'])
+            if item['type'] == 'Miscelaneous':
+                dispatch_misc_quantities[item['id']] = dispatch_misc_quantities.get(item['id'], 0) + item['quantity_to_dispatch']
+
+        available_tools = []
+        for tool in stock_list:
+            if tool['type'] == 'Unique_Tools':
+                if tool['id'] not in dispatch_ids:
+                    available_tools.append(tool)
+            elif tool['type'] == 'Miscelaneous':
+                dispatched_qty = dispatch_misc_quantities.get(tool['id'], 0)
+                remaining_stock = tool['quantity'] - dispatched_qty
+                if remaining_stock > 0:
+                    # st.cache_data hands every rerun its own copy of stock_list, so the row can be adjusted in place
+                    tool['quantity'] = remaining_stock
+                    # Adjust display name to show remaining stock
+                    tool['display_name'] = f"{tool['base_name']} - Stock: {remaining_stock}"
+                    available_tools.append(tool)
+
+        if not available_tools:
+            st.warning("No tools available in warehouse matching selected filters.")
+        else:
+            col_select, col_qty = st.columns([4, 1]) # Adjusted columns
+            with col_select:
+                tool_options = {tool['display_name']: tool for tool in available_tools}
+                selected_tool_display_name = st.selectbox("Select a tool", options=[""] + list(tool_options.keys()), key="out_dispatch_tool_selector", index=0)
+                selected_tool_data = tool_options.get(selected_tool_display_name)
+
+            quantity_to_dispatch = 1
+            if selected_tool_data:
+                if selected_tool_data['type'] == 'Miscelaneous':
+                    with col_qty:
+                        max_qty = selected_tool_data['quantity'] # This is the remaining stock
+                        quantity_to_dispatch = st.number_input("Quantity", min_value=1, max_value=max_qty, value=1, step=1, key="out_dispatch_qty_input")
             
-            # Button moved below the columns
-            if st.button("Add to Dispatch List", key="out_dispatch_add_to_list_button"):
-                # Get the base name of the tool without the stock info
-                clean_display_name = selected_tool_data['display_name'].split(' - Stock:')[0]
+                # Button moved below the columns
+                if st.button("Add to Dispatch List", key="out_dispatch_add_to_list_button"):
+                    # Get the base name of the tool without the stock info
+                    clean_display_name = selected_tool_data['base_name']
                 
-                st.session_state.dispatch_list.append({
-                    "id": selected_tool_data['id'],
-                    "display_name": clean_display_name,
-                    "quantity_to_dispatch": quantity_to_dispatch,
-                    "type": selected_tool_data['type'],
-                    "part_number": selected_tool_data['part_number'] # Add part_number here
-                })
-                st.rerun()
+                    st.session_state.dispatch_list.append({
+                        "id": selected_tool_data['id'],
+                        "display_name": clean_display_name,
+                        "quantity_to_dispatch": quantity_to_dispatch,
+                        "type": selected_tool_data['type'],
+                        "part_number": selected_tool_data['part_number'] # Add part_number here
+                    })
+                    st.rerun()
+
+    dispatch_tool_picker()
 
     # --- Display the list of tools to be dispatched ---
     if st.session_state.get('dispatch_list'):
         st.markdown("---")
         st.subheader("Tools to Dispatch")
-        dispatch_df = pd.DataFrame(st.session_state.dispatch_list)
-        
-        # Group by tool to sum quantities of the same misc tool
-        final_dispatch_df = dispatch_df.groupby(['id', 'display_name', 'type', 'part_number']).agg(
-            quantity_to_dispatch=('quantity_to_dispatch', 'sum')
-        ).reset_index()
 
-        st.dataframe(final_dispatch_df[['display_name', 'quantity_to_dispatch']], use_container_width=True)
+        # Group by tool to sum quantities of the same misc tool
+        dispatch_totals = {}
+        for item in st.session_state.dispatch_list:
+            tool_key = (item['id'], item['display_name'], item['type'], item['part_number'])
+            dispatch_totals[tool_key] = dispatch_totals.get(tool_key, 0) + item['quantity_to_dispatch']
+        final_dispatch_rows = [
+            {'id': tool_id, 'display_name': display_name, 'type': tool_type, 'part_number': part_number, 'quantity_to_dispatch': quantity}
+            for (tool_id, display_name, tool_type, part_number), quantity in dispatch_totals.items()
+        ]
+
+        dispatch_view = pd.DataFrame(
+            [(display_name, quantity) for (_, display_name, _, _), quantity in dispatch_totals.items()],
+            columns=['display_name', 'quantity_to_dispatch']
+        )
+        display_paginated(dispatch_view, key="out_dispatch_preview_page")
 
         col1_confirm, col2_confirm = st.columns(2)
         with col1_confirm:
@@ -1835,7 +1866,8 @@ elif main_menu == "OUT":
                         st.error(error)
                 else:
                     # Save the confirmed dispatch list to session state
-                    st.session_state.confirmed_dispatch_list = final_dispatch_df.to_dict('records')
+                    st.session_state.confirmed_dispatch_list = final_dispatch_rows
+                    st.session_state.confirmed_dispatch_view = dispatch_view # Reused by the note section on every rerun
                     st.session_state.dispatch_well = well_out
                     st.session_state.dispatch_responsible = responsible_out
                     st.session_state.dispatch_date = date_out.strftime('%Y-%m-%d')
@@ -1846,6 +1878,7 @@ elif main_menu == "OUT":
             if st.button("🗑️ Clear Dispatch List", key="out_clear_dispatch_button"):
                 st.session_state.dispatch_list = []
                 st.session_state.confirmed_dispatch_list = [] # Clear confirmed list too
+                st.session_state.pop('confirmed_dispatch_view', None)
                 st.rerun()
 
     # --- Delivery Note Generation Section (shown after dispatch is confirmed) ---
@@ -1867,7 +1900,7 @@ elif main_menu == "OUT":
             # Clear all related session state to reset the form
             keys_to_clear = [
                 'pdf_output_for_download', 'generated_delivery_note_filename',
-                'dispatch_list', 'confirmed_dispatch_list', 'dispatch_well',
+                'dispatch_list', 'confirmed_dispatch_list', 'confirmed_dispatch_view', 'dispatch_well',
                 'dispatch_responsible', 'dispatch_date', 'dispatch_client'
             ]
             for key in keys_to_clear:
@@ -1880,7 +1913,7 @@ elif main_menu == "OUT":
         st.markdown("---")
         st.subheader("Delivery Note Generation")
         st.write("**Confirmed Dispatch Details:**")
-        st.dataframe(pd.DataFrame(st.session_state.confirmed_dispatch_list)[['display_name', 'quantity_to_dispatch']], use_container_width=True)
+        display_paginated(st.session_state.confirmed_dispatch_view, key="out_dispatch_confirmed_page")
 
         doc_number = st.text_input("Document Number", key="out_dn_doc_number")
         contract_number = st.text_input("Contract Number", key="out_dn_contract_number")
@@ -1915,15 +1948,16 @@ elif main_menu == "OUT":
                     current_dispatch_well
                 )
 
-                pdf_output = generate_delivery_note_pdf(
-                    doc_number,
-                    contract_number,
-                    current_client_out, # Use client from the initial selection
-                    current_dispatch_well,
-                    current_dispatch_responsible,
-                    current_dispatch_date,
-                    current_dispatch_list
-                )
+                with st.spinner("Generating delivery note..."):
+                    pdf_output = generate_delivery_note_pdf(
+                        doc_number,
+                        contract_number,
+                        current_client_out, # Use client from the initial selection
+                        current_dispatch_well,
+                        current_dispatch_responsible,
+                        current_dispatch_date,
+                        current_dispatch_list
+                    )
                 file_name = f"{current_dispatch_date}_{current_client_out}_{current_dispatch_well}_Delivery_Note.pdf"
 
                 # Store the generated PDF in session state so the download button can appear on rerun
@@ -1941,119 +1975,133 @@ elif main_menu == "Field Status":
     if 'install_list' not in st.session_state:
         st.session_state.install_list = []
 
-    # --- UI for adding tools to the installation list (formless) ---
-    st.subheader("Select Tools to Mark as Installed")
+    @st.fragment
+    def install_tool_picker():
+        """Filters and tool selector for the installation list; widget changes here rerun only this fragment."""
+        # --- UI for adding tools to the installation list (formless) ---
+        st.subheader("Select Tools to Mark as Installed")
     
-    # Filter 1: Tool Category (Unique Tool or Miscellaneous)
-    selected_category_fs = st.selectbox(
-        "1) Select Tool Category",
-        options=["", "Unique_Tools", "Miscelaneous"],
-        key="fs_category_filter"
-    )
-
-    effective_application_fs = None
-    selected_application_fs = None # Initialize to None
-
-    if selected_category_fs == "Unique_Tools":
-        # Display Filter 2: Tool Application for Unique Tools
-        all_applications_fs = UNIQUE_TOOL_APPLICATION_OPTIONS
-        selected_application_fs = st.selectbox(
-            "2) Select Application",
-            options=[""] + all_applications_fs,
-            key="fs_application_filter"
+        # Filter 1: Tool Category (Unique Tool or Miscellaneous)
+        selected_category_fs = st.selectbox(
+            "1) Select Tool Category",
+            options=["", "Unique_Tools", "Miscelaneous"],
+            key="fs_category_filter"
+        )
+        if not selected_category_fs:
+            # Nothing to list until a category narrows the field stock query
+            st.info("Select a tool category to begin.")
+            return
+
+        effective_application_fs = None
+        selected_application_fs = None # Initialize to None
+
+        if selected_category_fs == "Unique_Tools":
+            # Display Filter 2: Tool Application for Unique Tools
+            selected_application_fs = st.selectbox(
+                "2) Select Application",
+                options=UNIQUE_TOOL_APPLICATION_OPTIONS_WITH_BLANK,
+                key="fs_application_filter"
+            )
+            effective_application_fs = selected_application_fs
+        elif selected_category_fs == "Miscelaneous":
+            # For Miscellaneous, application is implicitly "Miscellaneous"
+            effective_application_fs = "Miscellaneous"
+
+        # Filter 3: Tool Type (dynamically populated based on effective_application)
+        all_specific_types_fs = []
+        if effective_application_fs: # Only fetch specific types if an application is determined
+            all_specific_types_fs = get_tool_types_by_application(effective_application_fs)
+
+        selected_specific_type_fs = st.selectbox(
+            "3) Select Specific Tool Type",
+            options=[""] + all_specific_types_fs,
+            key="fs_specific_type_filter"
         )
-        effective_application_fs = selected_application_fs
-    elif selected_category_fs == "Miscelaneous":
-        # For Miscellaneous, application is implicitly "Miscellaneous"
-        effective_application_fs = "Miscellaneous"
-
-    # Filter 3: Tool Type (dynamically populated based on effective_application)
-    all_specific_types_fs = []
-    if effective_application_fs: # Only fetch specific types if an application is determined
-        all_specific_types_fs = get_tool_types_by_application(effective_application_fs)
-
-    selected_specific_type_fs = st.selectbox(
-        "3) Select Specific Tool Type",
-        options=[""] + all_specific_types_fs,
-        key="fs_specific_type_filter"
-    )
 
-    # --- Logic to calculate available tools based on what's already in the list ---
-    tools_in_field = get_tools_in_location(
-        'Field',
-        tool_category=selected_category_fs if selected_category_fs else None,
-        tool_application=effective_application_fs if effective_application_fs else None,
-        tool_specific_type=selected_specific_type_fs if selected_specific_type_fs else None
-    )
+        # --- Logic to calculate available tools based on what's already in the list ---
+        tools_in_field = get_tools_in_location(
+            'Field',
+            tool_category=selected_category_fs,
+            tool_application=effective_application_fs if effective_application_fs else None,
+            tool_specific_type=selected_specific_type_fs if selected_specific_type_fs else None
+        )
 
-    install_misc_quantities = {}
-    for item in st.session_state.install_list:
-        if item['type'] == 'Miscelaneous':
-            install_misc_quantities[item['id']] = install_misc_quantities.get(item['id'], 0) + item['quantity_to_install']
-
-    available_tools_field = []
-    for tool in tools_in_field:
-        if tool['type'] == 'Unique_Tools':
-            if not any(d['id'] == tool['id'] for d in st.session_state.install_list):
-                available_tools_field.append(tool)
-        elif tool['type'] == 'Miscelaneous':
-            installed_qty = install_misc_quantities.get(tool['id'], 0)
-            remaining_stock = tool['quantity'] - installed_qty
-            if remaining_stock > 0:
-                adjusted_tool = tool.copy()
-                adjusted_tool['quantity'] = remaining_stock
-                base_name = tool['display_name'].split(' - Stock:')[0]
-                adjusted_tool['display_name'] = f"{base_name} - Stock: {remaining_stock}"
-                available_tools_field.append(adjusted_tool)
-
-    if not available_tools_field:
-        st.warning("No more tools in field to mark as installed matching selected filters.")
-    else:
-        responsible_status = st.selectbox("Responsible", options=get_responsibles(), key="fs_resp_select")
-        date_status = st.date_input("Installation Date", value=datetime.today(), key="fs_date_input")
+        install_ids = set()
+        install_misc_quantities = {}
+        for item in st.session_state.install_list:
+            install_ids.add(item['id'])
+            if item['type'] == 'Miscelaneous':
+                install_misc_quantities[item['id']] = install_misc_quantities.get(item['id'], 0) + item['quantity_to_install']
+
+        available_tools_field = []
+        for tool in tools_in_field:
+            if tool['type'] == 'Unique_Tools':
+                if tool['id'] not in install_ids:
+                    available_tools_field.append(tool)
+            elif tool['type'] == 'Miscelaneous':
+                installed_qty = install_misc_quantities.get(tool['id'], 0)
+                remaining_stock = tool['quantity'] - installed_qty
+                if remaining_stock > 0:
+                    tool['quantity'] = remaining_stock # Per-rerun copy from the cache, like the OUT picker
+                    tool['display_name'] = f"{tool['base_name']} - Stock: {remaining_stock}"
+                    available_tools_field.append(tool)
+
+        if not available_tools_field:
+            st.warning("No more tools in field to mark as installed matching selected filters.")
+        else:
+            responsible_status = st.selectbox("Responsible", options=get_responsibles(), key="fs_resp_select")
+            date_status = st.date_input("Installation Date", value=datetime.today(), key="fs_date_input")
         
-        col_select, col_qty = st.columns([4, 1])
-        with col_select:
-            tool_options = {tool['display_name']: tool for tool in available_tools_field}
-            selected_tool_display_name = st.selectbox("Select a tool to install", options=[""] + list(tool_options.keys()), key="fs_install_tool_selector", index=0)
-            selected_tool_data = tool_options.get(selected_tool_display_name)
-
-        quantity_to_install = 1
-        if selected_tool_data:
-            if selected_tool_data['type'] == 'Miscelaneous':
-                with col_qty:
-                    max_qty = selected_tool_data['quantity']
-                    quantity_to_install = st.number_input("Quantity", min_value=1, max_value=max_qty, value=1, step=1, key="fs_install_qty_input")
+            col_select, col_qty = st.columns([4, 1])
+            with col_select:
+                tool_options = {tool['display_name']: tool for tool in available_tools_field}
+                selected_tool_display_name = st.selectbox("Select a tool to install", options=[""] + list(tool_options.keys()), key="fs_install_tool_selector", index=0)
+                selected_tool_data = tool_options.get(selected_tool_display_name)
+
+            quantity_to_install = 1
+            if selected_tool_data:
+                if selected_tool_data['type'] == 'Miscelaneous':
+                    with col_qty:
+                        max_qty = selected_tool_data['quantity']
+                        quantity_to_install = st.number_input("Quantity", min_value=1, max_value=max_qty, value=1, step=1, key="fs_install_qty_input")
             
-            if st.button("Add to Installation List", key="fs_add_to_install_list_button"):
-                clean_display_name = selected_tool_data['display_name'].split(' - Stock:')[0]
-                st.session_state.install_list.append({
-                    "id": selected_tool_data['id'],
-                    "display_name": clean_display_name,
-                    "quantity_to_install": quantity_to_install,
-                    "responsible": responsible_status,
-                    "date": date_status.strftime('%Y-%m-%d'),
-                    "type": selected_tool_data['type']
-                })
-                st.rerun()
+                if st.button("Add to Installation List", key="fs_add_to_install_list_button"):
+                    clean_display_name = selected_tool_data['base_name']
+                    st.session_state.install_list.append({
+                        "id": selected_tool_data['id'],
+                        "display_name": clean_display_name,
+                        "quantity_to_install": quantity_to_install,
+                        "responsible": responsible_status,
+                        "date": date_status.strftime('%Y-%m-%d'),
+                        "type": selected_tool_data['type']
+                    })
+                    st.rerun()
+
+    install_tool_picker()
 
     # --- Section to display and confirm the installation list ---
     if st.session_state.get('install_list'):
         st.markdown("---")
         st.subheader("Tools List to Confirm Installation")
-        install_df = pd.DataFrame(st.session_state.install_list)
-        
-        final_install_df = install_df.groupby(['id', 'display_name', 'type', 'responsible', 'date']).agg(
-            quantity_to_install=('quantity_to_install', 'sum')
-        ).reset_index()
 
-        st.dataframe(final_install_df[['display_name', 'quantity_to_install', 'responsible', 'date']], use_container_width=True)
+        # Same tool, responsible and date are installed as one movement
+        install_totals = {}
+        for item in st.session_state.install_list:
+            install_key = (item['id'], item['display_name'], item['responsible'], item['date'])
+            install_totals[install_key] = install_totals.get(install_key, 0) + item['quantity_to_install']
+
+        st.dataframe(pd.DataFrame(
+            [(display_name, quantity, responsible, date) for (_, display_name, responsible, date), quantity in install_totals.items()],
+            columns=['display_name', 'quantity_to_install', 'responsible', 'date']
+        ), use_container_width=True)
 
         col1, col2 = st.columns(2)
         with col1:
             if st.button("✅ Confirm All Installations", key="fs_confirm_installations_button"):
-                for item in final_install_df.to_dict('records'):
-                    update_field_tool_status(item['id'], 'Installed', item['responsible'], item['date'], item['quantity_to_install'])
+                update_field_tool_status_batch([
+                    (tool_id, 'Installed', responsible, date, quantity)
+                    for (tool_id, _, responsible, date), quantity in install_totals.items()
+                ])
                 st.success("✅ All installations have been successfully registered.")
                 st.session_state.install_list = []
                 st.rerun()
@@ -2066,30 +2114,48 @@ elif main_menu == "Field Status":
 
     # --- Section to view and revert installed tools ---
     st.subheader("Currently Installed Tools")
-    installed_tools = get_installed_tools_with_details()
+    # Page starts (last id of each previous page) so Previous can step back through the keyset pages
+    if 'fs_installed_page_starts' not in st.session_state:
+        st.session_state.fs_installed_page_starts = [0]
+    page_starts = st.session_state.fs_installed_page_starts
+    installed_tools = get_installed_tools_with_details(page_starts[-1], INSTALLED_PAGE_SIZE + 1) # One extra row tells whether a next page exists
+    has_next_page = len(installed_tools) > INSTALLED_PAGE_SIZE
+    installed_tools = installed_tools[:INSTALLED_PAGE_SIZE]
+    if not installed_tools and len(page_starts) > 1:
+        # The page emptied (e.g. its last tool was reverted); go back to the first page
+        st.session_state.fs_installed_page_starts = [0]
+        st.rerun()
     if not installed_tools:
         st.info("No tools marked as installed.")
     else:
         installed_df = pd.DataFrame(installed_tools)
-        installed_df['display_name'] = installed_df.apply(
-            lambda row: f"{row['part_number']} / {row['serial_number']} ({row['specific_type']})" if row['tool_type'] == 'Unique_Tools' else f"{row['part_number']} ({row['specific_type']}) - Stock: {int(row['quantity'])}",
-            axis=1
+        installed_df['display_name'] = (
+            installed_df['part_number'].astype(str) + ' / ' + installed_df['serial_number'].astype(str) + ' (' + installed_df['specific_type'].astype(str) + ')'
+        ).where(
+            installed_df['tool_type'] == 'Unique_Tools',
+            installed_df['part_number'].astype(str) + ' (' + installed_df['specific_type'].astype(str) + ') - Stock: ' + installed_df['quantity'].astype(int).astype(str)
         )
         
-        st.markdown("**Click the button to revert a tool installation.**")
-
-        for index, row in installed_df.iterrows():
-            col_info, col_date, col_well, col_action = st.columns([3, 1, 1, 1])
-            with col_info:
-                st.text(row['display_name'])
-            with col_date:
-                st.text(f"Inst: {row['installation_date']}")
-            with col_well:
-                st.text(f"Well: {row['well']}")
-            with col_action:
-                if st.button(f"Revert", key=f"fs_revert_{row['id']}"):
-                    update_field_tool_status(row['id'], 'RevertInstallation', get_responsibles()[0], datetime.today().strftime('%Y-%m-%d'), row['quantity'])
-                    st.success(f"The installation of {row['display_name']} has been reverted.")
+        st.dataframe(installed_df[['display_name', 'installation_date', 'well']], use_container_width=True)
+
+        # One selector and button for the page instead of a row of widgets per tool
+        installed_options = {row.display_name: row for row in installed_df.itertuples(index=False)}
+        selected_installed_name = st.selectbox("Select a tool to revert", options=[""] + list(installed_options.keys()), key="fs_revert_tool_select", index=0)
+        selected_installed = installed_options.get(selected_installed_name)
+        if selected_installed and st.button("Revert Installation", key="fs_revert_button"):
+            update_field_tool_status(selected_installed.id, 'RevertInstallation', get_responsibles()[0], datetime.today().strftime('%Y-%m-%d'), selected_installed.quantity)
+            st.success(f"The installation of {selected_installed.display_name} has been reverted.")
+            st.rerun()
+
+        if len(page_starts) > 1 or has_next_page:
+            col_prev, col_next = st.columns(2)
+            with col_prev:
+                if len(page_starts) > 1 and st.button("◀ Previous", key="fs_installed_prev_page"):
+                    page_starts.pop()
+                    st.rerun()
+            with col_next:
+                if has_next_page and st.button("Next ▶", key="fs_installed_next_page"):
+                    page_starts.append(installed_tools[-1]['id'])
                     st.rerun()
 
 # --- Reports Section ---
@@ -2105,13 +2171,9 @@ elif main_menu == "Reports":
             history_df = get_movements_history(start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
             st.dataframe(history_df, use_container_width=True)
             
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                history_df.to_excel(writer, index=False, sheet_name='MovementHistory')
-            excel_data = output.getvalue()
             st.download_button(
                 label="📥 Download Report in Excel",
-                data=excel_data,
+                data=lambda: excel_bytes(history_df, 'MovementHistory'), # Built only when the button is clicked
                 file_name=f"inventory_movement_report_{start_date.strftime('%Y%m%d')}_{end_date.strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 key="report_movement_download_button"
@@ -2123,13 +2185,9 @@ elif main_menu == "Reports":
             stock_df = get_full_stock_report()
             st.dataframe(stock_df, use_container_width=True)
 
-            output_stock = io.BytesIO()
-            with pd.ExcelWriter(output_stock, engine='xlsxwriter') as writer:
-                stock_df.to_excel(writer, index=False, sheet_name='CurrentStock')
-            excel_data_stock = output_stock.getvalue()
             st.download_button(
                 label="📥 Download Stock Report in Excel",
-                data=excel_data_stock,
+                data=lambda: excel_bytes(stock_df, 'CurrentStock'),
                 file_name=f"inventory_stock_report_{datetime.today().strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 key="report_current_stock_download_button"
@@ -2141,13 +2199,9 @@ elif main_menu == "Reports":
             warehouse_stock_df = get_warehouse_stock_report()
             st.dataframe(warehouse_stock_df, use_container_width=True)
 
-            output_warehouse_stock = io.BytesIO()
-            with pd.ExcelWriter(output_warehouse_stock, engine='xlsxwriter') as writer:
-                warehouse_stock_df.to_excel(writer, index=False, sheet_name='CurrentWarehouseStock')
-            excel_data_warehouse_stock = output_warehouse_stock.getvalue()
             st.download_button(
                 label="📥 Download Warehouse Stock Report in Excel",
-                data=excel_data_warehouse_stock,
+                data=lambda: excel_bytes(warehouse_stock_df, 'CurrentWarehouseStock'),
                 file_name=f"warehouse_stock_report_{datetime.today().strftime('%Y%m%d')}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 key="report_warehouse_stock_download_button"
@@ -2175,7 +2229,6 @@ elif main_menu == "Administration":
                 if st.form_submit_button("Add Responsible"):
                     manage_responsible('add', new_responsible_name)
                     st.success(f"Responsible '{new_responsible_name}' added.")
-                    st.cache_data.clear() # Clear cache to refresh selectbox options
                     st.rerun()
 
             st.markdown("---")
@@ -2188,7 +2241,6 @@ elif main_menu == "Administration":
                 if st.button("Deactivate Responsible"):
                     manage_responsible('deactivate', selected_responsible_deactivate)
                     st.success(f"Responsible '{selected_responsible_deactivate}' deactivated.")
-                    st.cache_data.clear() # Clear cache to refresh selectbox options
                     st.rerun()
             else:
                 st.info("No active responsibles to deactivate.")
@@ -2200,15 +2252,15 @@ elif main_menu == "Administration":
             all_responsibles = get_responsibles(active_only=False) # Get all to allow editing inactive ones too
             if all_responsibles:
                 selected_responsible_edit = st.selectbox("Select Responsible to Edit", options=all_responsibles, key="admin_edit_resp_select")
-                new_responsible_name_edit = st.text_input(f"New name for '{selected_responsible_edit}'", key="admin_new_resp_name_edit")
-                if st.button("Save Name Changes"):
-                    if new_responsible_name_edit and new_responsible_name_edit != selected_responsible_edit:
-                        manage_responsible('edit', selected_responsible_edit, new_responsible_name_edit)
-                        st.success(f"Responsible name updated from '{selected_responsible_edit}' to '{new_responsible_name_edit}'.")
-                        st.cache_data.clear()
-                        st.rerun()
-                    else:
-                        st.warning("Please enter a valid and different new name.")
+                with st.form("edit_responsible_form"):
+                    new_responsible_name_edit = st.text_input(f"New name for '{selected_responsible_edit}'", key="admin_new_resp_name_edit")
+                    if st.form_submit_button("Save Name Changes"):
+                        if new_responsible_name_edit and new_responsible_name_edit != selected_responsible_edit:
+                            manage_responsible('edit', selected_responsible_edit, new_responsible_name_edit)
+                            st.success(f"Responsible name updated from '{selected_responsible_edit}' to '{new_responsible_name_edit}'.")
+                            st.rerun()
+                        else:
+                            st.warning("Please enter a valid and different new name.")
             else:
                 st.info("No responsibles to edit.")
 
@@ -2223,7 +2275,6 @@ elif main_menu == "Administration":
                 if st.form_submit_button("Add Client"):
                     manage_client('add', new_client_name)
                     st.success(f"Client '{new_client_name}' added.")
-                    st.cache_data.clear() # Clear cache to refresh selectbox options
                     st.rerun()
 
             st.markdown("---")
@@ -2236,7 +2287,6 @@ elif main_menu == "Administration":
                 if st.button("Deactivate Client"):
                     manage_client('deactivate', selected_client_deactivate)
                     st.success(f"Client '{selected_client_deactivate}' deactivated.")
-                    st.cache_data.clear() # Clear cache to refresh selectbox options
                     st.rerun()
             else:
                 st.info("No active clients to deactivate.")
@@ -2248,15 +2298,15 @@ elif main_menu == "Administration":
             all_clients = get_clients(active_only=False) # Get all to allow editing inactive ones too
             if all_clients:
                 selected_client_edit = st.selectbox("Select Client to Edit", options=all_clients, key="admin_edit_client_select")
-                new_client_name_edit = st.text_input(f"New name for '{selected_client_edit}'", key="admin_new_client_name_edit")
-                if st.button("Save Name Changes"):
-                    if new_client_name_edit and new_client_name_edit != selected_client_edit:
-                        manage_client('edit', selected_client_edit, new_client_name_edit)
-                        st.success(f"Client name updated from '{selected_client_edit}' to '{new_client_name_edit}'.")
-                        st.cache_data.clear()
-                        st.rerun()
-                    else:
-                        st.warning("Please enter a valid and different new name.")
+                with st.form("edit_client_form"):
+                    new_client_name_edit = st.text_input(f"New name for '{selected_client_edit}'", key="admin_new_client_name_edit")
+                    if st.form_submit_button("Save Name Changes"):
+                        if new_client_name_edit and new_client_name_edit != selected_client_edit:
+                            manage_client('edit', selected_client_edit, new_client_name_edit)
+                            st.success(f"Client name updated from '{selected_client_edit}' to '{new_client_name_edit}'.")
+                            st.rerun()
+                        else:
+                            st.warning("Please enter a valid and different new name.")
             else:
                 st.info("No clients to edit.")
 
@@ -2276,7 +2326,6 @@ elif main_menu == "Administration":
                     if well_name:
                         manage_well('add', well_name, latitude=well_latitude, longitude=well_longitude, well_trajectory=well_trajectory, well_fluid=well_fluid)
                         st.success(f"Well '{well_name}' added.")
-                        st.cache_data.clear() # Clear cache to refresh selectbox options
                         st.rerun()
                     else:
                         st.warning("Well Name is mandatory.")
@@ -2291,7 +2340,6 @@ elif main_menu == "Administration":
                 if st.button("Deactivate Well"):
                     manage_well('deactivate', selected_well_deactivate)
                     st.success(f"Well '{selected_well_deactivate}' deactivated.")
-                    st.cache_data.clear() # Clear cache to refresh selectbox options
                     st.rerun()
             else:
                 st.info("No active wells to deactivate.")
@@ -2302,30 +2350,28 @@ elif main_menu == "Administration":
             st.write("Edit Well Name and Coordinates")
             all_wells_admin_df = get_all_wells_for_admin()
             if not all_wells_admin_df.empty:
-                # Convert DataFrame to a list of tuples for selectbox options
-                well_options_for_edit = [f"{row['name']} (Lat: {row['latitude']}, Lon: {row['longitude']})" for index, row in all_wells_admin_df.iterrows()]
-                selected_well_display = st.selectbox("Select Well to Edit", options=[""] + well_options_for_edit, key="admin_edit_well_select")
+                # Selectbox labels mapped to their well rows, so the selection needs no parsing or filtering
+                wells_for_edit = {f"{well['name']} (Lat: {well['latitude']}, Lon: {well['longitude']})": well for well in all_wells_admin_df.to_dict('records')}
+                selected_well_display = st.selectbox("Select Well to Edit", options=[""] + list(wells_for_edit.keys()), key="admin_edit_well_select")
                 
                 if selected_well_display:
-                    # Extract original name from display string
-                    original_well_name = selected_well_display.split(' (')[0]
-                    # Find the row for the selected well
-                    selected_well_row = all_wells_admin_df[all_wells_admin_df['name'] == original_well_name].iloc[0]
-
-                    new_well_name_edit = st.text_input(f"New name for '{original_well_name}'", value=selected_well_row['name'], key="admin_new_well_name_edit")
-                    new_well_latitude_edit = st.text_input(f"New Latitude for '{original_well_name}'", value=selected_well_row['latitude'], key="admin_new_well_lat_edit")
-                    new_well_longitude_edit = st.text_input(f"New Longitude for '{original_well_name}'", value=selected_well_row['longitude'], key="admin_new_well_lon_edit")
-                    new_well_trajectory_edit = st.selectbox(f"New Trajectory for '{original_well_name}'", options=["", "Vertical", "Horizontal", "Deviated"], index=["", "Vertical", "Horizontal", "Deviated"].index(selected_well_row['well_trajectory']) if selected_well_row['well_trajectory'] else 0, key="admin_new_well_trajectory_edit")
-                    new_well_fluid_edit = st.selectbox(f"New Fluid for '{original_well_name}'", options=["", "Oil", "Gas"], index=["", "Oil", "Gas"].index(selected_well_row['well_fluid']) if selected_well_row['well_fluid'] else 0, key="admin_new_well_fluid_edit")
-
-                    if st.button("Save Well Changes"):
-                        if new_well_name_edit:
-                            manage_well('edit', original_well_name, new_well_name_edit, new_well_latitude_edit, new_well_longitude_edit, new_well_trajectory_edit, new_well_fluid_edit)
-                            st.success(f"Well '{original_well_name}' updated.")
-                            st.cache_data.clear()
-                            st.rerun()
-                        else:
-                            st.warning("Well Name cannot be empty.")
+                    selected_well_row = wells_for_edit[selected_well_display]
+                    original_well_name = selected_well_row['name']
+
+                    with st.form("edit_well_form"):
+                        new_well_name_edit = st.text_input(f"New name for '{original_well_name}'", value=selected_well_row['name'], key="admin_new_well_name_edit")
+                        new_well_latitude_edit = st.text_input(f"New Latitude for '{original_well_name}'", value=selected_well_row['latitude'], key="admin_new_well_lat_edit")
+                        new_well_longitude_edit = st.text_input(f"New Longitude for '{original_well_name}'", value=selected_well_row['longitude'], key="admin_new_well_lon_edit")
+                        new_well_trajectory_edit = st.selectbox(f"New Trajectory for '{original_well_name}'", options=["", "Vertical", "Horizontal", "Deviated"], index=["", "Vertical", "Horizontal", "Deviated"].index(selected_well_row['well_trajectory']) if selected_well_row['well_trajectory'] else 0, key="admin_new_well_trajectory_edit")
+                        new_well_fluid_edit = st.selectbox(f"New Fluid for '{original_well_name}'", options=["", "Oil", "Gas"], index=["", "Oil", "Gas"].index(selected_well_row['well_fluid']) if selected_well_row['well_fluid'] else 0, key="admin_new_well_fluid_edit")
+
+                        if st.form_submit_button("Save Well Changes"):
+                            if new_well_name_edit:
+                                manage_well('edit', original_well_name, new_well_name_edit, new_well_latitude_edit, new_well_longitude_edit, new_well_trajectory_edit, new_well_fluid_edit)
+                                st.success(f"Well '{original_well_name}' updated.")
+                                st.rerun()
+                            else:
+                                st.warning("Well Name cannot be empty.")
             else:
                 st.info("No wells to edit.")
 
@@ -2397,13 +2443,6 @@ elif main_menu == "Administration":
                     key="tools_data_editor"
                 )
 
-            st.markdown("---")
-            st.markdown("### Reset Tool Database")
-            if st.button("Reset All Tools"):
-                reset_all_data()
-                st.success("All tools have been deleted from the database.")
-                st.rerun()
-                
                 # Get selected row IDs based on the 'Seleccionar' checkbox
                 selected_tool_ids = edited_df[edited_df['Seleccionar'] == True]['id'].tolist()
 
@@ -2427,8 +2466,7 @@ elif main_menu == "Administration":
                     with col_confirm_yes:
                         if st.button(f"Yes, Delete {num_to_delete} Tool(s) PERMANENTLY", key="confirm_final_delete_tools_button"):
                             try:
-                                for tool_id in st.session_state.tools_to_delete:
-                                    delete_tool(int(tool_id))
+                                delete_tools(st.session_state.tools_to_delete)
                                 st.success(f"{num_to_delete} tool(s) deleted successfully.")
                                 st.session_state.tools_to_delete = [] # Clear selection after deletion
                                 st.rerun()
@@ -2440,6 +2478,13 @@ elif main_menu == "Administration":
                             st.info("Deletion canceled.")
                             st.rerun()
 
+            st.markdown("---")
+            st.markdown("### Reset Tool Database")
+            if st.button("Reset All Tools"):
+                reset_all_data()
+                st.success("All tools have been deleted from the database.")
+                st.rerun()
+
             st.markdown("---")
             st.subheader("Danger Zone")
             st.warning("⚠️ Caution! The following actions are irreversible and will permanently delete data.")
@@ -2489,6 +2534,26 @@ elif main_menu == "Administration":
 
             st.markdown("---")
 
+            st.write("Bulk Upload Part Number Equivalences")
+            st.markdown("Upload a CSV file with the columns `supplier_pn`, `client_pn` and `client_description`. Existing supplier part numbers are updated.")
+            equivalences_file = st.file_uploader("Upload your CSV file", type=["csv"], key="admin_pn_equivalences_uploader")
+            if equivalences_file:
+                try:
+                    equivalences_df = pd.read_csv(equivalences_file, dtype=str).fillna('')
+                    missing_columns = {'supplier_pn', 'client_pn', 'client_description'} - set(equivalences_df.columns)
+                    if missing_columns:
+                        st.error(f"❌ Missing columns: {', '.join(sorted(missing_columns))}")
+                    else:
+                        equivalences_df = equivalences_df[(equivalences_df['supplier_pn'] != '') & (equivalences_df['client_pn'] != '')]
+                        st.write(f"{len(equivalences_df)} equivalence(s) with both Part Numbers found.")
+                        if st.button("Import Equivalences", key="admin_import_pn_equivalences_button") and not equivalences_df.empty:
+                            add_part_number_equivalences(list(equivalences_df[['supplier_pn', 'client_pn', 'client_description']].itertuples(index=False, name=None)))
+                            st.success(f"{len(equivalences_df)} equivalence(s) imported.")
+                except Exception as e:
+                    st.error(f"Error importing equivalences: {e}")
+
+            st.markdown("---")
+
             st.write("Delete Part Number Equivalence")
             pn_equivalences_df = get_part_number_equivalences()
             if not pn_equivalences_df.empty:
@@ -2506,7 +2571,6 @@ elif main_menu == "Administration":
             st.markdown("---")
 
             st.subheader("Current Part Number Equivalences")
-            pn_equivalences_df = get_part_number_equivalences()
             st.dataframe(pn_equivalences_df, use_container_width=True)
     else:
         # Show password input form if not authenticated
@@ -2527,30 +2591,8 @@ elif main_menu == "Map of Wells":
     wells_for_map_df = get_all_wells_for_map()
 
     if not wells_for_map_df.empty:
-        import folium
-        from streamlit_folium import st_folium
-
-        # Calculate center of the map
-        center_lat = wells_for_map_df['latitude'].mean()
-        center_lon = wells_for_map_df['longitude'].mean()
-
-        m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
-
-        for index, row in wells_for_map_df.iterrows():
-            popup_html = f"<b>Name:</b> {row['name']}<br>"
-            popup_html += f"<b>Latitude:</b> {row['latitude']}<br>"
-            popup_html += f"<b>Longitude:</b> {row['longitude']}<br>"
-            if row['well_trajectory']:
-                popup_html += f"<b>Trajectory:</b> {row['well_trajectory']}<br>"
-            if row['well_fluid']:
-                popup_html += f"<b>Fluid:</b> {row['well_fluid']}<br>"
-
-            folium.Marker(
-                [row['latitude'], row['longitude']],
-                tooltip=folium.Tooltip(popup_html)
-            ).add_to(m)
-        
-        st_folium(m, width="100%", height=1000)
+        # Fixed height: the iframe does not size itself to the map
+        st.iframe(wells_map_html(wells_for_map_df), height=1000)
 
     else:
         st.info("No wells with coordinates available to display on the map.")
@@ -2559,23 +2601,27 @@ elif main_menu == "Map of Wells":
 elif main_menu == "Query":
     st.header("🔍 Advanced Inventory Query")
 
-    # --- Filter Controls ---
-    col1, col2 = st.columns(2)
-    with col1:
-        # Sales Order Filter
-        so_options = [""] + get_all_sales_orders()
-        selected_so = st.selectbox("Filter by Sales Order", options=so_options, key="query_so_filter", index=0)
-    
-    with col2:
-        # Well Filter
-        well_options = [""] + get_all_wells()
-        selected_well = st.selectbox("Filter by Well", options=well_options, key="query_well_filter", index=0)
+    # Filters live in a form so changing them doesn't rerun the page until Search is pressed
+    with st.form("query_form"):
+        # --- Filter Controls ---
+        col1, col2 = st.columns(2)
+        with col1:
+            # Sales Order Filter
+            so_options = [""] + get_all_sales_orders()
+            selected_so = st.selectbox("Filter by Sales Order", options=so_options, key="query_so_filter", index=0)
+
+        with col2:
+            # Well Filter
+            well_options = [""] + get_all_wells()
+            selected_well = st.selectbox("Filter by Well", options=well_options, key="query_well_filter", index=0)
 
-    # --- Text Search ---
-    query_term = st.text_input("Search by Part Number, Serial Number, or Description:", key="query_text_input")
+        # --- Text Search ---
+        query_term = st.text_input("Search by Part Number, Serial Number, or Description:", key="query_text_input")
 
-    # --- Search Button and Logic ---
-    if st.button("Search", key="query_search_button"):
+        search_submitted = st.form_submit_button("Search", key="query_search_button")
+
+    # --- Search Logic ---
+    if search_submitted:
         # At least one filter or a search term must be provided
         if query_term or selected_so or selected_well:
             results_df = search_inventory(
@@ -2587,18 +2633,21 @@ elif main_menu == "Query":
             if not results_df.empty:
                 st.dataframe(results_df, use_container_width=True)
                 
-                # Provide a download button for the results
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    results_df.to_excel(writer, index=False, sheet_name='QueryResults')
-                excel_data = output.getvalue()
+                # Provide a download button for the results; the xlsx is only written if it is clicked
                 st.download_button(
                     label="📥 Download Results in Excel",
-                    data=excel_data,
+                    data=lambda: excel_bytes(results_df, 'QueryResults'),
                     file_name=f"query_results_{datetime.today().strftime('%Y%m%d')}.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     key="query_download_button"
                 )
+                st.download_button(
+                    label="📥 Download Results in CSV",
+                    data=lambda: results_df.to_csv(index=False).encode('utf-8'), # Much faster than xlsx for large results
+                    file_name=f"query_results_{datetime.today().strftime('%Y%m%d')}.csv",
+                    mime="text/csv",
+                    key="query_download_csv_button"
+                )
             else:
                 st.info("No tools found matching your criteria.")
         else: